@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline JSONL batch inference.
+
+Every non-blank input line is one request: ``{"prompt": ...}`` for generate
+or ``{"messages": [...]}`` for chat, with optional ``model``, ``system``,
+``options`` and ``custom_id``. Every input line produces exactly one output
+line, written in input order, so the output line count doubles as the
+resume checkpoint.
+
+Usage (against a running server):
+    python batch_jobs.py prompts.jsonl results.jsonl --model tinyllama-gguf --concurrency 8
+"""
+from __future__ import annotations
+
+import sys
+import json
+import uuid
+import argparse
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Set, Tuple
+
+# submit(record, cancel) -> result dict for one input record
+SubmitFn = Callable[[Dict, threading.Event], Dict]
+
+# Results held back waiting for an earlier, slower record, per worker
+REORDER_WINDOW_PER_WORKER = 4
+
+# Ollama-style counters copied from server replies into result lines
+METRIC_FIELDS = (
+    "total_duration",
+    "load_duration",
+    "prompt_eval_count",
+    "prompt_eval_duration",
+    "eval_count",
+    "eval_duration",
+)
+
+
+def completed_count(output_path: Path) -> int:
+    """Count finished records in output_path, dropping a torn last line."""
+    if not output_path.exists():
+        return 0
+    count = 0
+    good_bytes = 0
+    with open(output_path, "rb+") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            count += 1
+            good_bytes += len(line)
+        f.truncate(good_bytes)
+    return count
+
+
+def _read_records(input_path: Path) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """Yield (index, record, parse_error) for each non-blank input line."""
+    index = 0
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("record must be a JSON object")
+                yield index, record, None
+            except ValueError as e:
+                yield index, None, f"invalid JSON: {e}"
+            index += 1
+
+
+def count_records(input_path: Path) -> int:
+    with open(input_path, "r", encoding="utf-8") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def record_models(input_path: Path) -> Set[str]:
+    """Models named by the input records (records without one use the job's model)."""
+    return {
+        str(record["model"]) for _, record, _ in _read_records(input_path)
+        if record is not None and record.get("model")
+    }
+
+
+def make_result(record: Dict, model: str, content: str, metrics: Optional[Dict] = None) -> Dict:
+    """Shape a finished record like the matching /api/generate or /api/chat reply.
+
+    metrics are the Ollama-style counters (eval_count, eval_duration, ...).
+    """
+    if "messages" in record:
+        reply = {"model": model, "message": {"role": "assistant", "content": content}, "done": True}
+    else:
+        reply = {"model": model, "response": content, "done": True}
+    reply.update(metrics or {})
+    return reply
+
+
+def _run_one(submit: SubmitFn, index: int, record: Optional[Dict], error: Optional[str], cancel: threading.Event) -> Dict:
+    head = {"index": index, "custom_id": (record or {}).get("custom_id")}
+    if error is None:
+        try:
+            return {**head, **submit(record, cancel)}
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e) or type(e).__name__
+    return {**head, "error": error}
+
+
+def run_batch(
+    input_path: Path,
+    output_path: Path,
+    submit: SubmitFn,
+    concurrency: int = 4,
+    cancel: Optional[threading.Event] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict:
+    """Run every input record through submit with `concurrency` in flight.
+
+    Output already present in output_path is kept and those records are
+    skipped, so re-running an interrupted job resumes it. After a cancel
+    nothing more is written; in-flight records are redone on resume.
+    """
+    cancel = cancel or threading.Event()
+    concurrency = max(1, concurrency)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    skip = completed_count(output_path)
+    written = skip
+    failed = 0
+    ready: Dict[int, Dict] = {}
+    pending: Dict[Future, int] = {}
+    window = concurrency * REORDER_WINDOW_PER_WORKER
+    if progress:
+        progress(written, failed)
+
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+
+        def collect(block: bool) -> None:
+            nonlocal written, failed
+            if not pending:
+                return
+            done, _ = wait(list(pending), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for fut in done:
+                ready[pending.pop(fut)] = fut.result()
+            if cancel.is_set():
+                return
+            lines = []
+            while written in ready:
+                result = ready.pop(written)
+                failed += "error" in result
+                lines.append(json.dumps(result, ensure_ascii=False) + "\n")
+                written += 1
+            if lines:
+                out.writelines(lines)
+                out.flush()
+                if progress:
+                    progress(written, failed)
+
+        for index, record, error in _read_records(input_path):
+            if index < skip:
+                continue
+            if cancel.is_set():
+                break
+            # Bound memory: wait while too many results queue behind a slow one
+            while not cancel.is_set() and len(pending) + len(ready) >= window:
+                collect(block=True)
+            pending[pool.submit(_run_one, submit, index, record, error, cancel)] = index
+            collect(block=False)
+        while pending:
+            collect(block=True)
+
+    return {
+        "status": "cancelled" if cancel.is_set() else "finished",
+        "resumed_from": skip,
+        "written": written,
+        "failed": failed,
+    }
+
+
+class BatchJob:
+    def __init__(self, model: str, input_path: Path, output_path: Path, concurrency: int) -> None:
+        self.job_id = f"batch-{uuid.uuid4().hex[:12]}"
+        self.model = model
+        self.input_path = input_path
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.started_at = datetime.now().isoformat()
+        self.ended_at: Optional[str] = None
+        self.total = count_records(input_path)
+        self.written = 0
+        self.failed = 0
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.cancel_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.job_id,
+            "model": self.model,
+            "input_path": str(self.input_path),
+            "output_path": str(self.output_path),
+            "concurrency": self.concurrency,
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+            "total": self.total,
+            "written": self.written,
+            "failed": self.failed,
+            "running": self.is_running(),
+            "cancelled": self.cancel_event.is_set(),
+            "error": self.error,
+        }
+
+
+class BatchJobManager:
+    """Background batch jobs, one thread each."""
+
+    def __init__(self) -> None:
+        self.jobs: Dict[str, BatchJob] = {}
+
+    def start(self, model: str, input_path: Path, output_path: Path, submit: SubmitFn, concurrency: int) -> Dict:
+        for job in self.jobs.values():
+            if job.is_running() and job.output_path == output_path:
+                return {"status": "busy", "message": "a job is already writing this output", "job": job.to_dict()}
+        job = BatchJob(model, input_path, output_path, concurrency)
+        self.jobs[job.job_id] = job
+
+        def _progress(written: int, failed: int) -> None:
+            job.written = written
+            job.failed = failed
+
+        def _runner() -> None:
+            try:
+                job.result = run_batch(input_path, output_path, submit, concurrency, job.cancel_event, _progress)
+                job.written = job.result["written"]
+            except Exception as e:
+                job.error = str(e)
+            finally:
+                job.ended_at = datetime.now().isoformat()
+
+        job.thread = threading.Thread(target=_runner, daemon=True)
+        job.thread.start()
+        return {"status": "started", "job": job.to_dict()}
+
+    def status(self, job_id: str) -> Dict:
+        job = self.jobs.get(job_id)
+        if not job:
+            return {"status": "absent"}
+        return {"status": "running" if job.is_running() else "finished", "job": job.to_dict()}
+
+    def cancel(self, job_id: str) -> Dict:
+        job = self.jobs.get(job_id)
+        if not job or not job.is_running():
+            return {"status": "noop"}
+        job.cancel_event.set()
+        return {"status": "cancelled", "job": job.to_dict()}
+
+    def list(self) -> Dict:
+        return {"jobs": [job.to_dict() for job in self.jobs.values()]}
+
+
+BATCH_JOBS = BatchJobManager()
+
+
+def _http_submit(server: str, model: str, timeout: float) -> SubmitFn:
+    import requests
+
+    def submit(record: Dict, cancel: threading.Event) -> Dict:
+        name = record.get("model") or model
+        body = {"model": name, "options": record.get("options")}
+        if "messages" in record:
+            r = requests.post(f"{server}/api/chat", json={**body, "messages": record["messages"]}, timeout=timeout)
+        elif "prompt" in record:
+            body.update(prompt=record["prompt"], system=record.get("system"))
+            r = requests.post(f"{server}/api/generate", json=body, timeout=timeout)
+        else:
+            raise ValueError("record needs 'prompt' or 'messages'")
+        if r.status_code != 200:
+            raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+        data = r.json()
+        metrics = {k: data[k] for k in METRIC_FIELDS if k in data}
+        if "messages" in record:
+            return make_result(record, name, data["message"]["content"], metrics)
+        return make_result(record, name, data["runtime_response"].get("content", ""), metrics)
+
+    return submit
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run a JSONL file of generate/chat requests")
+    parser.add_argument("input", help="Input JSONL (one request per line)")
+    parser.add_argument("output", help="Output JSONL; an existing file is resumed")
+    parser.add_argument("--model", "-m", required=True, help="Model for records without a 'model' field")
+    parser.add_argument("--server", default="http://127.0.0.1:8155", help="Model server URL")
+    parser.add_argument("--concurrency", "-c", type=int, default=4, help="Requests in flight (match the runtime's parallel slots)")
+    parser.add_argument("--timeout", type=float, default=600, help="Per-request timeout in seconds")
+    args = parser.parse_args()
+
+    input_path, output_path = Path(args.input), Path(args.output)
+    total = count_records(input_path)
+
+    def _progress(written: int, failed: int) -> None:
+        print(f"\r{written}/{total} written, {failed} failed", end="", flush=True)
+
+    submit = _http_submit(args.server.rstrip("/"), args.model, args.timeout)
+    try:
+        result = run_batch(input_path, output_path, submit, args.concurrency, progress=_progress)
+    except KeyboardInterrupt:
+        print("\nInterrupted; re-run the same command to resume")
+        return 130
+    print(f"\n{result['status']}: {result['written']}/{total} written ({result['failed']} failed, resumed from {result['resumed_from']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
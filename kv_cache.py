@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Session KV-cache persistence for llama.cpp runtimes.
+
+Slot state is written with llama.cpp's slot save/restore API into
+<cache_dir>/<model>/ (the runtime's --slot-save-path). Files are evicted
+least-recently-used first once the directory grows past max_bytes.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+
+import requests
+
+
+def _safe_name(session_id: str) -> str:
+    # The hash of the raw id keeps ids that sanitize alike ("a/b", "a_b") apart
+    digest = hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:12]
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", session_id)[:100] + f"-{digest}.bin"
+
+
+class SessionKVCache:
+    def __init__(self, cache_dir: Path, max_bytes: int, timeout_sec: int = 60) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.timeout_sec = timeout_sec
+        self.saves = 0
+        self.restores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def model_dir(self, model: str) -> Path:
+        path = self.cache_dir / model
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def path_for(self, model: str, session_id: str) -> Path:
+        return self.model_dir(model) / _safe_name(session_id)
+
+    def has(self, model: str, session_id: str) -> bool:
+        return self.path_for(model, session_id).exists()
+
+    def _slot_action(self, port: int, slot: int, action: str, filename: str) -> Dict:
+        r = requests.post(
+            f"http://127.0.0.1:{port}/slots/{slot}",
+            params={"action": action},
+            json={"filename": filename},
+            timeout=self.timeout_sec,
+        )
+        if r.status_code != 200:
+            return {"ok": False, "status": r.status_code, "error": r.text[:200]}
+        return {"ok": True, **r.json()}
+
+    def save(self, model: str, port: int, slot: int, session_id: str) -> Dict:
+        """Save the slot's KV cache as the session's state."""
+        filename = _safe_name(session_id)
+        self.model_dir(model)
+        try:
+            res = self._slot_action(port, slot, "save", filename)
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+        if res.get("ok"):
+            self.saves += 1
+            self.enforce_cap()
+        return res
+
+    def restore(self, model: str, port: int, slot: int, session_id: str) -> Dict:
+        """Load the session's saved state into the slot, if there is one."""
+        path = self.path_for(model, session_id)
+        if not path.exists():
+            return {"ok": False, "error": "not_cached"}
+        try:
+            res = self._slot_action(port, slot, "restore", path.name)
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+        if res.get("ok"):
+            self.restores += 1
+            # Mark as recently used for LRU eviction
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+        return res
+
+    def drop(self, model: str, session_id: str) -> None:
+        try:
+            self.path_for(model, session_id).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _files(self):
+        return [p for p in self.cache_dir.glob("*/*.bin") if p.is_file()]
+
+    def enforce_cap(self) -> None:
+        with self._lock:
+            files = []
+            for p in self._files():
+                try:
+                    st = p.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, p))
+            total = sum(size for _, size, _ in files)
+            for _, size, p in sorted(files, key=lambda f: f[0]):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    p.unlink()
+                    total -= size
+                    self.evictions += 1
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict:
+        files = self._files()
+        return {
+            "dir": str(self.cache_dir),
+            "files": len(files),
+            "size_mb": round(sum(p.stat().st_size for p in files) / (1024 ** 2), 2),
+            "max_mb": round(self.max_bytes / (1024 ** 2), 2),
+            "saves": self.saves,
+            "restores": self.restores,
+            "evictions": self.evictions,
+            "checked_at": time.time(),
+        }
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Every writer thread updates its own shard (a plain dict reached through
+threading.local), so recording a sample never takes a lock and never
+contends with other requests. A scrape copies and sums the shards; values
+from a sample recorded mid-scrape show up on the next scrape. Shards of
+finished threads are folded into a base shard.
+"""
+from __future__ import annotations
+
+import math
+import threading
+import weakref
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers cached hits (ms) up to long generations and cold loads
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKENS_PER_SEC_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 150, 250, 500)
+
+# (labels, value) pairs of one metric family
+Samples = Iterable[Tuple[Dict[str, str], float]]
+# collector() -> [(name, type, help, samples)], evaluated at scrape time
+Collector = Callable[[], Iterable[Tuple[str, str, str, Samples]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+class _ShardOwner:
+    """Lives in the thread-local; its collection marks the thread as finished."""
+
+
+class _Sharded:
+    """Per-thread dicts of label values -> state; readers merge all shards.
+
+    Shards are keyed by thread ident. When a thread exits its shard is
+    folded into a base shard, so totals never drop and the number of
+    shards stays at the number of live writer threads.
+    """
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str]) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: Dict[int, Dict] = {}
+        self._base: Dict = {}
+        self._owners: Dict[int, weakref.ref] = {}
+        # Taken only when a thread starts or stops writing and on scrapes; an
+        # RLock because a retiring thread's callback may run inside a holder
+        self._lock = threading.RLock()
+
+    def _shard(self) -> Dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            ident = threading.get_ident()
+            shard = self._local.shard = {}
+            owner = self._local.owner = _ShardOwner()
+            # The thread-local is cleared when the thread exits, which drops owner
+            ref = weakref.ref(owner, lambda _, ident=ident, shard=shard: self._retire(ident, shard))
+            with self._lock:
+                previous = self._shards.get(ident)
+                if previous is not None:
+                    # A reused ident whose previous thread has not been retired yet
+                    self._fold(self._base, previous)
+                self._shards[ident] = shard
+                self._owners[ident] = ref
+        return shard
+
+    def _retire(self, ident: int, shard: Dict) -> None:
+        with self._lock:
+            if self._shards.get(ident) is shard:
+                del self._shards[ident]
+                del self._owners[ident]
+                self._fold(self._base, shard)
+
+    def _fold(self, into: Dict, shard: Dict) -> None:
+        raise NotImplementedError
+
+    def _key(self, labels: Sequence) -> Tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(v) for v in labels)
+
+    def _snapshots(self) -> List[Dict]:
+        # dict.copy() runs without releasing the GIL, so each copy is consistent
+        with self._lock:
+            return [self._base.copy()] + [shard.copy() for shard in self._shards.values()]
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0.0) + amount
+
+    def _fold(self, into: Dict, shard: Dict) -> None:
+        for key, value in shard.items():
+            into[key] = into.get(key, 0.0) + value
+
+    def values(self) -> Dict[Tuple, float]:
+        totals: Dict[Tuple, float] = {}
+        for snap in self._snapshots():
+            for key, value in snap.items():
+                totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        for key, value in sorted(self.values().items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Gauge(Counter):
+    """Up/down counter (in-flight requests); each shard holds its own delta."""
+
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Sharded):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str], buckets: Sequence[float]) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value: float) -> None:
+        shard = self._shard()
+        key = self._key(labels)
+        row = shard.get(key)
+        if row is None:
+            # [per-bucket counts..., +Inf count, sum]
+            row = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def _fold(self, into: Dict, shard: Dict) -> None:
+        for key, row in shard.items():
+            total = into.get(key)
+            into[key] = list(row) if total is None else [a + b for a, b in zip(total, row)]
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        merged: Dict[Tuple, List[float]] = {}
+        for snap in self._snapshots():
+            for key, row in snap.items():
+                row = list(row)
+                total = merged.get(key)
+                merged[key] = row if total is None else [a + b for a, b in zip(total, row)]
+        for key, row in sorted(merged.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for le, count in zip(self.buckets + (math.inf,), row[:-1]):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(le)}, cumulative
+            yield f"{self.name}_sum", labels, row[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: List[_Sharded] = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn: Collector) -> None:
+        """Register fn for values that already live elsewhere (cache stats, runtime state)."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str, samples) -> None:
+            lines.append(f"# HELP {name} {_escape(help_text)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+
+        for metric in self._metrics:
+            family(metric.name, metric.kind, metric.help, metric.samples())
+        for collector in self._collectors:
+            try:
+                collected = list(collector())
+            except Exception:
+                continue
+            for name, kind, help_text, samples in collected:
+                family(name, kind, help_text, ((name, labels, value) for labels, value in samples))
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+
+def route_template(scope: Dict) -> Optional[str]:
+    """Path template of the matched route ("/download/status/{model}"), if any."""
+    route = scope.get("route")
+    return getattr(route, "path", None)
@@ -7,16 +7,23 @@ Port: 8001 (API Gateway)
 """
 
 import os
+import json
+import uuid
+import base64
+import asyncio
+from array import array
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple, Union
 from collections import deque
+from contextvars import ContextVar
 import time
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.concurrency import iterate_in_threadpool
 
 from system_detector import detect_system_info
 from db_manager import load_registry, save_registry, scan_models_directory
@@ -28,10 +35,45 @@ from router import (
     start_idle_killer,
     stop_all_running,
     mark_access,
+    assign_slot,
+    register_unload_hook,
+    wait_until_ready,
+    load_runtime_config,
+    start_warm_pool,
+    predict_models,
+    STATE as RUNTIME_STATE,
 )
 from downloader import DOWNLOADER as DL
-from pydantic import BaseModel
-from runtime_db import upsert_model_state, delete_model_state, get_all_states
+from batch_jobs import BATCH_JOBS, make_result, record_models
+from kv_cache import SessionKVCache
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, METRICS, TOKENS_PER_SEC_BUCKETS, route_template
+from profiler import MAX_DURATION_SEC as PROFILE_MAX_SEC, ProfilerBusy, collapsed as collapsed_stacks, sample as sample_profile
+from response_cache import ResponseCache, is_complete, is_deterministic, model_digest
+from session_store import SessionStore
+from timeseries import LatencyTimeSeries
+from tracing import (
+    TRACE_HEADER,
+    Trace,
+    TraceExporter,
+    activate,
+    current_span_id,
+    current_trace,
+    deactivate,
+    span,
+    valid_trace_id,
+)
+from pydantic import BaseModel, ConfigDict
+from runtime_db import (
+    upsert_model_state,
+    delete_model_state,
+    get_all_states,
+    get_profile,
+    upsert_profile,
+    delete_profile,
+    get_all_profiles,
+    append_usage,
+    get_usage_since,
+)
 import requests as httpx
 import threading
 import os
@@ -40,6 +82,7 @@ sys.path.insert(0, str(Path(__file__).parent / "scripts"))
 from registry_manager import ModelRegistry
 from auth_manager import AUTH_MANAGER
 from hf_models_api import HuggingFaceModelsAPI
+from gguf_loader import config_context_length, gguf_context_length
 
 
 ROOT_DIR = Path(__file__).parent
@@ -48,6 +91,49 @@ REGISTRY_FILE = MODELS_DIR / "models_registry.json"
 PORT = int(os.getenv("MODEL_SERVER_PORT", 8155))  # uncommon default port
 START_TIME = time.time()
 DB_PATH = ROOT_DIR / "data" / "runtime.db"
+# Batch job inputs and outputs are confined to this directory
+BATCH_DIR = ROOT_DIR / "data" / "batch"
+
+# Read once at import; sections are looked up from here, not re-read from disk
+_RUNTIME_CFG = load_runtime_config(ROOT_DIR)
+
+# Session KV caches saved on eviction/unload and restored on resume
+_KV_CFG = _RUNTIME_CFG.get("kv_cache", {})
+KV_CACHE: Optional[SessionKVCache] = (
+    SessionKVCache(ROOT_DIR / _KV_CFG.get("dir", "data/kv_cache"), int(_KV_CFG.get("max_mb", 4096)) * 1024 * 1024)
+    if _KV_CFG.get("enabled", True) else None
+)
+
+# Exact-match cache for deterministic (temperature 0 / fixed seed) completions
+_RC_CFG = _RUNTIME_CFG.get("response_cache", {})
+RESPONSE_CACHE: Optional[ResponseCache] = (
+    ResponseCache(
+        max_entries=int(_RC_CFG.get("max_entries", 1024)),
+        disk_dir=(ROOT_DIR / _RC_CFG["disk_dir"]) if _RC_CFG.get("disk_dir") else None,
+        max_disk_entries=int(_RC_CFG.get("max_disk_entries", 10000)),
+    )
+    if _RC_CFG.get("enabled", True) else None
+)
+
+# Per-request tracing spans, written by a background exporter
+_TRACE_CFG = _RUNTIME_CFG.get("tracing", {})
+TRACE_EXPORTER: Optional[TraceExporter] = (
+    TraceExporter(
+        exporter=_TRACE_CFG.get("exporter", "jsonl"),
+        path=ROOT_DIR / _TRACE_CFG.get("path", "logs/traces.jsonl"),
+        otlp_endpoint=_TRACE_CFG.get("otlp_endpoint", "http://127.0.0.1:4318/v1/traces"),
+        min_duration_ms=float(_TRACE_CFG.get("min_duration_ms", 0)),
+    )
+    if _TRACE_CFG.get("enabled", True) else None
+)
+
+# Per-minute / per-hour latency rollups by route and model (dashboards)
+_TS_CFG = _RUNTIME_CFG.get("timeseries", {})
+REQUEST_SERIES = LatencyTimeSeries(
+    minute_slots=int(_TS_CFG.get("minute_slots", 1440)),
+    hour_slots=int(_TS_CFG.get("hour_slots", 720)),
+    max_series=int(_TS_CFG.get("max_series", 200)),
+)
 
 # Initialize Model Registry
 MODEL_REGISTRY = ModelRegistry(str(REGISTRY_FILE))
@@ -94,28 +180,90 @@ LOG_DIR = ROOT_DIR / "logs"
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 SERVER_LOG = LOG_DIR / "server.log"
 
+# Per-request tags set by handlers (the model) and read back by the middleware
+_REQUEST_TAGS: ContextVar[Optional[Dict]] = ContextVar("request_tags", default=None)
+
+# Prometheus metrics (GET /metrics); routes are labelled by template, not raw path
+HTTP_REQUESTS = METRICS.counter(
+    "zombiecoder_http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+)
+HTTP_LATENCY = METRICS.histogram(
+    "zombiecoder_http_request_duration_seconds", "HTTP request latency, until the response body is sent", ("method", "route")
+)
+
+
+class RequestLoggerMiddleware:
+    """Log method, path, status and duration of every HTTP request.
+
+    Also opens the request's trace (returned in X-Trace-Id). Plain ASGI
+    rather than BaseHTTPMiddleware: the latter swallows the client's
+    http.disconnect, so streaming responses never got cancelled.
+    """
 
-class RequestLoggerMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         t0 = time.time()
-        response = await call_next(request)
-        duration_ms = int((time.time() - t0) * 1000)
+        status = {"code": 500}
+        tags: Dict = {}
+        tags_token = _REQUEST_TAGS.set(tags)
+        trace = None
+        if TRACE_EXPORTER is not None:
+            incoming = dict(scope.get("headers") or []).get(TRACE_HEADER.lower().encode(), b"")
+            trace = Trace(f"{scope.get('method', '')} {scope.get('path', '')}", valid_trace_id(incoming.decode("latin-1")))
+            trace_token = activate(trace)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if trace is not None:
+                    headers = list(message.get("headers") or [])
+                    headers.append((TRACE_HEADER.lower().encode(), trace.trace_id.encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.time() - t0
+            route = route_template(scope) or "unmatched"
+            HTTP_REQUESTS.inc(scope.get("method", ""), route, status["code"])
+            HTTP_LATENCY.observe(scope.get("method", ""), route, value=duration)
+            _REQUEST_TAGS.reset(tags_token)
+            REQUEST_SERIES.record(route, tags.get("model", ""), duration * 1000, status["code"])
+            if trace is not None:
+                deactivate(trace_token)
+                trace.name = f"{scope.get('method', '')} {route}"
+                trace.finish(**{"http.method": scope.get("method", ""), "http.route": route, "http.status_code": status["code"]})
+                # Only requests that did traced work (reached a model) are exported
+                if trace.spans:
+                    TRACE_EXPORTER.submit(trace)
+            self._log(scope, status["code"], int(duration * 1000), trace.trace_id if trace else None)
+
+    @staticmethod
+    def _log(scope, status_code: int, duration_ms: int, trace_id: Optional[str] = None) -> None:
+        method = scope.get("method", "")
+        path = scope.get("path", "")
         try:
             REQUEST_LOG.append({
                 "ts": datetime.now().isoformat(),
-                "method": request.method,
-                "path": request.url.path,
-                "status": response.status_code,
+                "method": method,
+                "path": path,
+                "status": status_code,
                 "duration_ms": duration_ms,
+                "trace_id": trace_id,
             })
             # Append JSON line to file log
             with open(SERVER_LOG, "a", encoding="utf-8", errors="ignore") as lf:
                 lf.write(
-                    f"{datetime.now().isoformat()}\t{request.method}\t{request.url.path}\t{response.status_code}\t{duration_ms}ms\n"
+                    f"{datetime.now().isoformat()}\t{method}\t{path}\t{status_code}\t{duration_ms}ms\n"
                 )
         except Exception:
             pass
-        return response
 
 
 app.add_middleware(RequestLoggerMiddleware)
@@ -131,6 +279,9 @@ async def on_startup():
     save_registry(REGISTRY_FILE, registry)
     # Start idle killer (10 minutes)
     start_idle_killer(timeout_sec=600, check_interval_sec=30)
+    # Keep pinned models resident and preload predicted ones
+    _start_warm_pool()
+    SESSIONS.start_maintenance(interval_sec=10)
     # Kick off background auto-download of smallest GGUF if missing
     def _auto_download_worker():
         try:
@@ -344,6 +495,39 @@ async def logs_server(limit: int = 200):
         return {"path": str(SERVER_LOG), "tail": []}
 
 
+@app.get("/monitoring/profile")
+async def monitoring_profile(seconds: float = 10, interval_ms: float = 10, format: str = "collapsed"):
+    """Sample every gateway thread for `seconds`; collapsed stacks for flamegraphs"""
+    if not 0 < seconds <= PROFILE_MAX_SEC:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {PROFILE_MAX_SEC}]")
+    if format not in ("collapsed", "json"):
+        raise HTTPException(status_code=400, detail="format must be 'collapsed' or 'json'")
+    try:
+        # Runs in a worker thread, so the event loop keeps serving (and is sampled)
+        profile = await asyncio.to_thread(sample_profile, seconds, interval_ms)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "collapsed":
+        return Response(content=collapsed_stacks(profile), media_type="text/plain; charset=utf-8")
+    stacks = sorted(profile["stacks"].items(), key=lambda kv: kv[1], reverse=True)
+    return {**profile, "stacks": [{"stack": stack, "count": count} for stack, count in stacks]}
+
+
+@app.get("/monitoring/timeseries")
+async def monitoring_timeseries(
+    route: Optional[str] = None,
+    model: Optional[str] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    resolution: str = "auto",
+):
+    """Request count, error and latency percentile rollups over a time range"""
+    try:
+        return {**REQUEST_SERIES.query(route, model, start, end, resolution), "store": REQUEST_SERIES.stats()}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 # ------------------------
 # Downloader endpoints
 # ------------------------
@@ -579,16 +763,39 @@ async def runtime_get_status():
     return status
 
 
-@app.post("/runtime/load/{model}")
-async def runtime_load_model(model: str, threads: int = 4):
-    """Load model with automatic format detection and runtime selection"""
+RUNTIME_STARTS = METRICS.counter("zombiecoder_runtime_starts_total", "Runtime processes spawned", ("model", "format"))
+RUNTIME_RESTARTS = METRICS.counter(
+    "zombiecoder_runtime_restarts_total", "Runtime spawns after an earlier runtime of the model exited", ("model",)
+)
+RUNTIME_LOAD_LATENCY = METRICS.histogram(
+    "zombiecoder_runtime_load_duration_seconds", "Auto-load time from spawn request to a ready runtime", ("model",)
+)
+_STARTED_MODELS: set = set()
+
+
+def _load_with_profile(model: str, threads: int = 4) -> Dict:
+    """Load an installed model with its saved runtime profile and persist state."""
     model_dir = MODELS_DIR / model
-    
     if not model_dir.exists():
-        raise HTTPException(status_code=404, detail=f"Model directory not found: {model_dir}")
-    
+        return {"status": "error", "reason": "not_found", "message": f"Model directory not found: {model_dir}"}
+    try:
+        profile = get_profile(DB_PATH, model)
+    except Exception:
+        profile = None
+    if KV_CACHE is not None:
+        profile = dict(profile or {})
+        profile.setdefault("slot_save_path", str(KV_CACHE.model_dir(model)))
     # Load model (runtime will auto-detect format)
-    res = runtime_load(ROOT_DIR, model, model_dir, threads=threads)
+    res = runtime_load(ROOT_DIR, model, model_dir, threads=threads, profile=profile)
+    spawned = res.get("status") in ("loading", "ready") and res.get("reason") != "already_running"
+    if spawned:
+        RUNTIME_STARTS.inc(model, res.get("format", "unknown"))
+        if model in _STARTED_MODELS:
+            # An earlier runtime of this model exited (crash, idle eviction or unload)
+            RUNTIME_RESTARTS.inc(model)
+        _STARTED_MODELS.add(model)
+    if res.get("format") == "gguf" and spawned:
+        threading.Thread(target=_warm_prefix_cache, args=(model,), daemon=True).start()
     
     # Update database
     try:
@@ -601,10 +808,20 @@ async def runtime_load_model(model: str, threads: int = 4):
         )
     except Exception:
         pass
-    
     return res
 
 
+@app.post("/runtime/load/{model}")
+async def runtime_load_model(model: str, threads: int = 4):
+    """Load model with automatic format detection and runtime selection"""
+    model_dir = MODELS_DIR / model
+    
+    if not model_dir.exists():
+        raise HTTPException(status_code=404, detail=f"Model directory not found: {model_dir}")
+    
+    return _load_with_profile(model, threads=threads)
+
+
 @app.post("/runtime/unload/{model}")
 async def runtime_unload_model(model: str):
     res = runtime_unload(model)
@@ -620,6 +837,143 @@ async def runtime_config():
     return check_runtime_available(ROOT_DIR)
 
 
+def runtime_status_for(model: str) -> str:
+    for m in runtime_status().get("models", []):
+        if m.get("model") == model:
+            return m.get("status", "stopped")
+    return "stopped"
+
+
+# Warm pool: pinned models plus predictive preloading from request history
+
+def _warm_pool_config() -> Dict:
+    return _RUNTIME_CFG.get("warm_pool", {})
+
+
+def _start_warm_pool() -> None:
+    cfg = _warm_pool_config()
+    pred = cfg.get("predictive", {})
+    history_sec = int(pred.get("history_sec", 7 * 86400))
+    try:
+        history = get_usage_since(DB_PATH, time.time() - history_sec)
+    except Exception:
+        history = []
+    start_warm_pool(
+        _load_with_profile,
+        pinned=cfg.get("pinned", []),
+        history=history,
+        interval_sec=int(pred.get("interval_sec", 300)),
+        horizon_sec=int(pred.get("horizon_sec", 1800)),
+        history_sec=history_sec,
+        # top_n=0 disables prediction; pinned models are still kept warm
+        top_n=int(pred.get("top_n", 1)) if pred.get("enabled", True) else 0,
+        min_requests=int(pred.get("min_requests", 3)),
+        persist_fn=lambda events: append_usage(DB_PATH, events),
+    )
+
+
+@app.get("/runtime/warm")
+async def runtime_warm():
+    pred = _warm_pool_config().get("predictive", {})
+    predicted = predict_models(
+        list(RUNTIME_STATE.usage),
+        time.time(),
+        horizon_sec=int(pred.get("horizon_sec", 1800)),
+        history_sec=int(pred.get("history_sec", 7 * 86400)),
+        top_n=int(pred.get("top_n", 1)),
+        min_requests=int(pred.get("min_requests", 3)),
+    )
+    return {
+        "pinned": sorted(RUNTIME_STATE.pinned),
+        "predicted": [{"model": m, "requests": c} for m, c in predicted],
+        "warm_until": dict(RUNTIME_STATE.model_to_warm_until),
+    }
+
+
+@app.post("/runtime/pin/{model}")
+async def runtime_pin(model: str):
+    if not (MODELS_DIR / model).exists():
+        raise HTTPException(status_code=404, detail=f"Model directory not found: {model}")
+    RUNTIME_STATE.pinned.add(model)
+    return {"model": model, "pinned": True, "status": runtime_status_for(model)}
+
+
+@app.post("/runtime/unpin/{model}")
+async def runtime_unpin(model: str):
+    RUNTIME_STATE.pinned.discard(model)
+    return {"model": model, "pinned": False}
+
+
+# Per-model runtime profiles (applied at load time)
+
+KV_CACHE_TYPES = {"f32", "f16", "bf16", "q8_0", "q4_0", "q4_1", "iq4_nl", "q5_0", "q5_1"}
+POOLING_TYPES = {"none", "mean", "cls", "last", "rank"}
+QUANTIZE_MODES = {"none", "int8", "bf16"}
+
+
+class RuntimeProfile(BaseModel):
+    # Unknown keys (typos, options no runtime has) are rejected, not dropped
+    model_config = ConfigDict(extra="forbid")
+
+    ctx_size: Optional[int] = None
+    batch_size: Optional[int] = None
+    ubatch_size: Optional[int] = None
+    parallel: Optional[int] = None
+    cont_batching: Optional[bool] = None
+    cache_type_k: Optional[str] = None
+    cache_type_v: Optional[str] = None
+    gpu_layers: Optional[int] = None
+    flash_attn: Optional[bool] = None
+    mmap: Optional[bool] = None
+    mlock: Optional[bool] = None
+    embedding: Optional[bool] = None
+    pooling: Optional[str] = None
+    embed_batch_size: Optional[int] = None
+    batch_wait_ms: Optional[float] = None
+    max_queue: Optional[int] = None
+    quantize: Optional[str] = None
+
+
+@app.get("/runtime/profiles")
+async def runtime_profiles():
+    return {"profiles": get_all_profiles(DB_PATH)}
+
+
+@app.get("/runtime/profile/{model}")
+async def runtime_profile_get(model: str):
+    profile = get_profile(DB_PATH, model)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"No runtime profile for '{model}'")
+    return {"model": model, "profile": profile}
+
+
+@app.put("/runtime/profile/{model}")
+async def runtime_profile_put(model: str, profile: RuntimeProfile):
+    data = profile.model_dump(exclude_none=True)
+    for key in ("ctx_size", "batch_size", "ubatch_size", "parallel", "embed_batch_size", "max_queue"):
+        if key in data and data[key] < 1:
+            raise HTTPException(status_code=400, detail=f"{key} must be >= 1")
+    if "batch_wait_ms" in data and data["batch_wait_ms"] < 0:
+        raise HTTPException(status_code=400, detail="batch_wait_ms must be >= 0")
+    for key in ("cache_type_k", "cache_type_v"):
+        if key in data and data[key] not in KV_CACHE_TYPES:
+            raise HTTPException(status_code=400, detail=f"{key} must be one of {sorted(KV_CACHE_TYPES)}")
+    if "pooling" in data and data["pooling"] not in POOLING_TYPES:
+        raise HTTPException(status_code=400, detail=f"pooling must be one of {sorted(POOLING_TYPES)}")
+    if "quantize" in data and data["quantize"] not in QUANTIZE_MODES:
+        raise HTTPException(status_code=400, detail=f"quantize must be one of {sorted(QUANTIZE_MODES)}")
+    upsert_profile(DB_PATH, model, data)
+    # Profiles take effect on the next load
+    applied = runtime_status_for(model) == "stopped"
+    return {"model": model, "profile": data, "reload_required": not applied}
+
+
+@app.delete("/runtime/profile/{model}")
+async def runtime_profile_delete(model: str):
+    delete_profile(DB_PATH, model)
+    return {"model": model, "status": "deleted"}
+
+
 # Ollama-compatible minimal endpoints (placeholders)
 
 @app.get("/api/tags")
@@ -661,7 +1015,7 @@ async def api_tags():
             "model": name,
             "modified_at": m.get("detected_at", datetime.now().isoformat()),
             "size": int(m.get("size_mb", 0) * 1024 * 1024),
-            "digest": "local",
+            "digest": model_digest(model_dir),
             "status": "installed",
             "runtime_status": rstatus,
             "format": fmt,
@@ -697,28 +1051,10 @@ class ChatRequest(BaseModel):
     messages: List[ChatMessage]
     stream: bool = False
     options: Optional[Dict] = None
+    session_id: Optional[str] = None  # send only new messages; history is kept server-side
 
 
-@app.post("/api/generate")
-async def api_generate(req: GenerateRequest):
-    # Verify installed
-    scanned = scan_models_directory(MODELS_DIR)
-    if not any(m["name"] == req.model for m in scanned):
-        raise HTTPException(status_code=404, detail=f"Model '{req.model}' not found")
-    # Find running port for this model
-    rt = runtime_status()
-    port = None
-    for m in rt.get("models", []):
-        if m.get("model") == req.model and m.get("status") == "ready":
-            port = m.get("port")
-            break
-    if not port:
-        raise HTTPException(status_code=409, detail="Model is not running. Load it via /runtime/load/{model} first.")
-    # Proxy to llama.cpp server completion endpoint
-    try:
-        url = f"http://127.0.0.1:{port}/completion"
-        # Build prompt with system context if provided
-        system_prompt = req.system or """You are ZombieCoder Local AI Assistant.
+DEFAULT_SYSTEM_PROMPT = """You are ZombieCoder Local AI Assistant.
 
 IMPORTANT FACTS (never contradict these):
 - Provider: ZombieCoder Local AI Framework
@@ -727,51 +1063,572 @@ IMPORTANT FACTS (never contradict these):
 - You run on the user's own hardware, not on any remote server
 
 You help users with coding, questions, and tasks. Always be honest about being a local AI model."""
-        
-        full_prompt = f"{system_prompt}\n\nUser: {req.prompt}\nAssistant:"
-        # Force non-streaming single JSON response and limit tokens for low latency
-        payload = {"prompt": full_prompt, "stream": False, "n_predict": 64}
-        # Try up to ~60s to allow runtime to finish loading the model
-        deadline = time.time() + 60
-        last_resp = None
-        while True:
-            r = httpx.post(url, json=payload, timeout=180)
-            last_resp = r
-            if r.status_code == 200:
+
+# Max time a request waits for an auto-load before getting 503
+AUTOLOAD_TIMEOUT_SEC = float(os.getenv("AUTOLOAD_TIMEOUT_SEC", 120))
+
+# In-flight auto-loads, so concurrent first requests share one load
+_LOAD_TASKS: Dict[str, asyncio.Future] = {}
+
+
+def _require_installed(model: str) -> None:
+    with span("model.lookup", model=model):
+        scanned = scan_models_directory(MODELS_DIR)
+    if not any(m["name"] == model for m in scanned):
+        raise HTTPException(status_code=404, detail=f"Model '{model}' not found")
+    # Installed names only, so unknown models cannot grow the time-series store
+    tags = _REQUEST_TAGS.get()
+    if tags is not None:
+        tags["model"] = model
+
+
+def _ready_port(model: str) -> Optional[int]:
+    for m in runtime_status().get("models", []):
+        if m.get("model") == model and m.get("status") == "ready":
+            return m.get("port")
+    return None
+
+
+async def _autoload(model: str) -> int:
+    t0 = time.perf_counter()
+    with span("runtime.spawn", model=model) as attrs:
+        res = await asyncio.to_thread(_load_with_profile, model)
+        attrs.update(status=res.get("status"), format=res.get("format"))
+    if res.get("status") not in ("loading", "ready"):
+        raise HTTPException(status_code=502, detail=f"Auto-load failed for '{model}': {res.get('reason') or res.get('message')}")
+    with span("runtime.wait_ready", model=model) as attrs:
+        status = await asyncio.to_thread(wait_until_ready, model, AUTOLOAD_TIMEOUT_SEC)
+        attrs["status"] = status
+    port = _ready_port(model)
+    if status != "ready" or not port:
+        raise HTTPException(status_code=503, detail=f"Model '{model}' did not become ready ({status})")
+    RUNTIME_LOAD_LATENCY.observe(model, value=time.perf_counter() - t0)
+    return port
+
+
+async def ensure_runtime(model: str) -> int:
+    """Return the port of a ready runtime, loading the model if needed.
+
+    Requests that arrive while a load is in progress join it instead of
+    starting another one.
+    """
+    port = _ready_port(model)
+    if port:
+        return port
+    # Waiting here is the request's admission: the model is not ready yet
+    with span("runtime.admission", model=model) as attrs:
+        task = _LOAD_TASKS.get(model)
+        attrs["joined_load"] = task is not None
+        if task is None:
+            task = asyncio.ensure_future(_autoload(model))
+            _LOAD_TASKS[model] = task
+            task.add_done_callback(lambda _t: _LOAD_TASKS.pop(model, None))
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), AUTOLOAD_TIMEOUT_SEC)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=503,
+                detail=f"Model '{model}' is still loading, retry shortly",
+                headers={"Retry-After": "5"},
+            )
+
+
+async def _ensure_runtime_timed(model: str) -> Tuple[int, int]:
+    """ensure_runtime() plus the nanoseconds it took (Ollama's load_duration)."""
+    t0 = time.perf_counter_ns()
+    port = await ensure_runtime(model)
+    return port, time.perf_counter_ns() - t0
+
+
+def _ollama_metrics(data: Dict, total_ns: int, load_ns: int = 0, cached: bool = False) -> Dict:
+    """Ollama-style token counts and durations (ns) from a runtime response.
+
+    Both runtimes report llama.cpp "timings"; tokens_evaluated/predicted
+    are the fallback. llama.cpp's prompt_n leaves out the cached prompt
+    prefix. A response-cache hit evaluated nothing, so its eval durations
+    are 0.
+    """
+    timings = data.get("timings") or {}
+    prompt_n = timings.get("prompt_n", data.get("tokens_evaluated"))
+    eval_n = timings.get("predicted_n", data.get("tokens_predicted"))
+    return {
+        "total_duration": total_ns,
+        "load_duration": load_ns,
+        "prompt_eval_count": int(prompt_n or 0),
+        "prompt_eval_duration": 0 if cached else int(float(timings.get("prompt_ms") or 0) * 1e6),
+        "eval_count": int(eval_n or 0),
+        "eval_duration": 0 if cached else int(float(timings.get("predicted_ms") or 0) * 1e6),
+    }
+
+
+class ClientDisconnected(Exception):
+    """The HTTP client went away while its generation was running."""
+
+
+# How often an in-flight proxy request checks for a client disconnect
+DISCONNECT_POLL_SEC = 0.25
+
+
+def _iter_runtime_stream(port: int, payload: Dict, cancel: threading.Event, handle: Dict) -> Iterator[Dict]:
+    """Yield chunks from the runtime's streaming /completion (blocking).
+
+    The upstream request always streams, so closing handle["response"]
+    drops the connection and llama.cpp releases the slot mid-generation.
+    """
+    url = f"http://127.0.0.1:{port}/completion"
+    handle["port"] = port
+    # Try up to ~60s to allow runtime to finish loading the model
+    deadline = time.time() + 60
+    while True:
+        r = httpx.post(url, json={**payload, "stream": True}, stream=True, timeout=(5, 180))
+        if r.status_code == 200:
+            break
+        text = r.text
+        r.close()
+        # llama.cpp may return 503 while still "Loading model"
+        if r.status_code == 503 and ("Loading model" in text or "loading" in text.lower()):
+            if time.time() < deadline and not cancel.is_set():
+                time.sleep(1.0)
+                continue
+        if r.status_code == 503:
+            # Runtime queue full: let the client back off and retry
+            raise HTTPException(
+                status_code=503,
+                detail=f"Runtime busy: {text[:200]}",
+                headers={"Retry-After": r.headers.get("Retry-After", "1")},
+            )
+        if r.status_code == 400:
+            # The request itself was refused (e.g. prompt longer than the context)
+            raise HTTPException(status_code=400, detail=f"Runtime rejected request: {text[:200]}")
+        # Any other non-200 or timeout → error
+        raise HTTPException(status_code=502, detail=f"Runtime error {r.status_code}: {text[:200]}")
+    handle["connected_ns"] = time.perf_counter_ns()
+    handle["response"] = r
+    try:
+        if "text/event-stream" not in r.headers.get("content-type", ""):
+            # Runtime answered with a single JSON body
+            yield _note_chunk(handle, r.json())
+            return
+        for line in r.iter_lines():
+            if cancel.is_set():
+                raise ClientDisconnected()
+            if not line or not line.startswith(b"data: "):
+                continue
+            data = line[len(b"data: "):]
+            if data.strip() == b"[DONE]":
                 break
-            # llama.cpp may return 503 while still "Loading model"
-            if r.status_code == 503 and ("Loading model" in r.text or "loading" in r.text.lower()):
-                if time.time() < deadline:
-                    time.sleep(1.0)
-                    continue
-            # Any other non-200 or timeout → error
-            raise HTTPException(status_code=502, detail=f"Runtime error {r.status_code}: {r.text[:200]}")
-        data = last_resp.json() if last_resp is not None else {}
-        # mark last access for idle killer
+            chunk = json.loads(data)
+            if "error" in chunk:
+                # The runtime failed mid-stream (llama.cpp and transformers_runner)
+                err = chunk["error"]
+                message = err.get("message") if isinstance(err, dict) else err
+                raise HTTPException(status_code=502, detail=f"Runtime error: {message}")
+            yield _note_chunk(handle, chunk)
+    finally:
+        r.close()
+
+
+def _note_chunk(handle: Dict, chunk: Dict) -> Dict:
+    """Remember when the first token arrived and the last chunk (it carries timings)."""
+    if chunk.get("content") and "first_token_ns" not in handle:
+        handle["first_token_ns"] = time.perf_counter_ns()
+    handle["last"] = chunk
+    return chunk
+
+
+COMPLETIONS = METRICS.counter(
+    "zombiecoder_completions_total", "Runtime completions by outcome (ok, error, cancelled)", ("model", "outcome")
+)
+COMPLETION_LATENCY = METRICS.histogram(
+    "zombiecoder_completion_duration_seconds", "Runtime completion latency, excluding auto-load", ("model",)
+)
+TIME_TO_FIRST_TOKEN = METRICS.histogram(
+    "zombiecoder_time_to_first_token_seconds", "Time from sending a completion to its first token", ("model",)
+)
+TOKENS_PER_SEC = METRICS.histogram(
+    "zombiecoder_tokens_per_second", "Decode speed of each completion", ("model",), buckets=TOKENS_PER_SEC_BUCKETS
+)
+PROMPT_TOKENS = METRICS.counter("zombiecoder_prompt_tokens_total", "Prompt tokens evaluated by the runtime", ("model",))
+GENERATED_TOKENS = METRICS.counter("zombiecoder_generated_tokens_total", "Tokens generated by the runtime", ("model",))
+INFLIGHT = METRICS.gauge(
+    "zombiecoder_inflight_completions", "Completions sent to the runtime and not yet finished (queue depth)", ("model",)
+)
+
+
+def _trace_completion(model: str, handle: Dict, t0: int, end: int, outcome: str) -> None:
+    """Add the runtime's stages to the current trace.
+
+    Connect and first-token times are measured here; the split of the time
+    before the first token into queueing and prompt eval comes from the
+    runtime's reported prompt_ms.
+    """
+    trace = current_trace()
+    if trace is None:
+        return
+    parent = trace.add_span("runtime.completion", t0, end, current_span_id(), model=model, port=handle.get("port"), outcome=outcome)["span_id"]
+    connected = handle.get("connected_ns")
+    if connected is None:
+        return
+    trace.add_span("proxy.connect", t0, connected, parent)
+    first = handle.get("first_token_ns")
+    if first is None:
+        trace.add_span("runtime.generate", connected, end, parent)
+        return
+    timings = (handle.get("last") or {}).get("timings") or {}
+    prompt_ms = float(timings.get("prompt_ms") or 0)
+    prompt_start = max(connected, first - int(prompt_ms * 1e6))
+    if prompt_start > connected:
+        trace.add_span("runtime.queue", connected, prompt_start, parent)
+    trace.add_span("prompt_eval", prompt_start, first, parent, tokens=timings.get("prompt_n"), runtime_ms=prompt_ms)
+    trace.add_span("decode", first, end, parent, tokens=timings.get("predicted_n"), runtime_ms=timings.get("predicted_ms"))
+
+
+@contextmanager
+def _completion_metrics(model: str, handle: Dict) -> Iterator[None]:
+    """Record latency, first-token time, tokens and queue depth of one completion,
+    and its stages as trace spans.
+
+    handle is the dict given to _iter_runtime_stream, which notes the chunks.
+    """
+    t0 = time.perf_counter_ns()
+    INFLIGHT.inc(model)
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except (ClientDisconnected, GeneratorExit, asyncio.CancelledError):
+        outcome = "cancelled"
+        raise
+    finally:
+        end = time.perf_counter_ns()
+        INFLIGHT.dec(model)
+        COMPLETIONS.inc(model, outcome)
+        COMPLETION_LATENCY.observe(model, value=(end - t0) / 1e9)
+        _trace_completion(model, handle, t0, end, outcome)
+        if "first_token_ns" in handle:
+            TIME_TO_FIRST_TOKEN.observe(model, value=(handle["first_token_ns"] - t0) / 1e9)
+        if outcome == "ok" and handle.get("last"):
+            counts = _ollama_metrics(handle["last"], 0)
+            PROMPT_TOKENS.inc(model, amount=counts["prompt_eval_count"])
+            GENERATED_TOKENS.inc(model, amount=counts["eval_count"])
+            if counts["eval_count"] and counts["eval_duration"]:
+                TOKENS_PER_SEC.observe(model, value=counts["eval_count"] / (counts["eval_duration"] / 1e9))
+
+
+def _collect_completion(port: int, payload: Dict, cancel: threading.Event, handle: Dict) -> Dict:
+    """Run a completion to the end and merge its chunks into one response."""
+    parts: List[str] = []
+    last: Dict = {}
+    for chunk in _iter_runtime_stream(port, payload, cancel, handle):
+        parts.append(chunk.get("content", ""))
+        last = chunk
+    data = dict(last)
+    data["content"] = "".join(parts)
+    return data
+
+
+async def _stream_completion(model: str, port: int, payload: Dict) -> AsyncIterator[Dict]:
+    """Yield runtime chunks as they arrive; closing the iterator aborts upstream.
+
+    Starlette cancels a StreamingResponse when the client disconnects, which
+    lands in the finally block and drops the runtime connection.
+    """
+    cancel = threading.Event()
+    handle: Dict = {}
+    try:
+        with _completion_metrics(model, handle):
+            async for chunk in iterate_in_threadpool(_iter_runtime_stream(port, payload, cancel, handle)):
+                yield chunk
+    finally:
+        cancel.set()
+        _abort_upstream(handle)
         try:
-            mark_access(req.model)
+            mark_access(model)
         except Exception:
             pass
-        # update session if provided
-        sid = req.session_id or (req.options or {}).get("session_id") if req.options else None
-        if sid:
-            _session_touch(sid, last_model=req.model)
-        return {"model": req.model, "runtime_port": port, "runtime_response": data}
+
+
+def _abort_upstream(handle: Dict) -> None:
+    r = handle.get("response")
+    if r is None:
+        return
+    try:
+        r.close()
+    except Exception:
+        pass
+
+
+async def _proxy_completion(request: Request, model: str, port: int, payload: Dict) -> Dict:
+    """Proxy a completion, cancelling it upstream if the client disconnects."""
+    cancel = threading.Event()
+    handle: Dict = {}
+    try:
+        with _completion_metrics(model, handle):
+            fut = asyncio.ensure_future(asyncio.to_thread(_collect_completion, port, payload, cancel, handle))
+            while True:
+                done, _ = await asyncio.wait({fut}, timeout=DISCONNECT_POLL_SEC)
+                if done:
+                    data = fut.result()
+                    break
+                if await request.is_disconnected():
+                    cancel.set()
+                    _abort_upstream(handle)
+                    raise ClientDisconnected()
+    except ClientDisconnected:
+        raise HTTPException(status_code=499, detail="Client closed request")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"Proxy error: {e}")
+    # mark last access for idle killer
+    try:
+        mark_access(model)
+    except Exception:
+        pass
+    return data
+
+
+# Ollama option -> llama.cpp /completion parameter (also understood by
+# transformers_runner). num_ctx is only honoured by transformers_runner;
+# llama.cpp's context size is fixed at load time by the runtime profile.
+OLLAMA_OPTION_MAP = {
+    "num_predict": "n_predict",
+    "temperature": "temperature",
+    "top_k": "top_k",
+    "top_p": "top_p",
+    "stop": "stop",
+    "seed": "seed",
+    "repeat_penalty": "repeat_penalty",
+    "num_ctx": "num_ctx",
+}
+DEFAULT_NUM_PREDICT = 64
+# Our prompts end with "Assistant:"; stop before the model invents the next user turn
+DEFAULT_STOP = ["\nUser:"]
+
+
+def _completion_payload(prompt: str, options: Optional[Dict], templated: bool = True) -> Dict:
+    """Build a /completion payload from an Ollama-style options dict.
+
+    templated=False is for raw prompts that do not use our User:/Assistant:
+    template, so the template's stop string is not added.
+    """
+    default_stop = DEFAULT_STOP if templated else []
+    payload: Dict = {
+        "prompt": prompt,
+        "stream": False,
+        "n_predict": DEFAULT_NUM_PREDICT,
+        "stop": list(default_stop),
+        # Reuse the slot's KV cache for the common prompt prefix
+        "cache_prompt": True,
+    }
+    for key, value in (options or {}).items():
+        target = OLLAMA_OPTION_MAP.get(key)
+        if target is None or value is None:
+            continue
+        if key == "stop":
+            value = [value] if isinstance(value, str) else list(value)
+            value = default_stop + [v for v in value if v not in default_stop]
+        payload[target] = value
+    return payload
+
+
+def _generate_prompt(prompt: str, system: Optional[str] = None) -> str:
+    """Wrap a bare prompt in the User:/Assistant: template with a system context."""
+    return f"{system or DEFAULT_SYSTEM_PROMPT}\n\nUser: {prompt}\nAssistant:"
+
+
+def _chat_prompt(messages: List[Dict]) -> str:
+    system = DEFAULT_SYSTEM_PROMPT
+    turns: List[str] = []
+    for m in messages:
+        if m["role"] == "system":
+            system = m["content"]
+        elif m["role"] == "assistant":
+            turns.append(f"Assistant: {m['content']}")
+        else:
+            turns.append(f"User: {m['content']}")
+    return f"{system}\n\n" + "\n".join(turns) + "\nAssistant:"
+
+
+@app.post("/api/generate")
+async def api_generate(req: GenerateRequest, request: Request):
+    # Verify installed
+    _require_installed(req.model)
+    t0 = time.perf_counter_ns()
+    payload = _completion_payload(_generate_prompt(req.prompt, req.system), req.options)
+    sid = req.session_id or (req.options or {}).get("session_id")
+    cache_key, cached = _cached_response(req.model, payload)
+    if cached is not None:
+        if sid:
+            _session_touch(sid, last_model=req.model)
+        return {
+            "model": req.model,
+            "runtime_port": None,
+            "runtime_response": cached,
+            "cached": True,
+            **_ollama_metrics(cached, time.perf_counter_ns() - t0, cached=True),
+        }
+    # Find running port for this model, loading it on first use
+    port, load_ns = await _ensure_runtime_timed(req.model)
+    slot = await _pin_session_slot(req.model, sid, port, payload) if sid else None
+    data = await _proxy_completion(request, req.model, port, payload)
+    with span("postprocess"):
+        _cache_store(cache_key, data)
+        # update session if provided
+        if sid:
+            _session_touch(sid, last_model=req.model, slot=slot, runtime_pid=RUNTIME_STATE.model_to_pid.get(req.model))
+    return {
+        "model": req.model,
+        "runtime_port": port,
+        "runtime_response": data,
+        "cached": False,
+        **_ollama_metrics(data, time.perf_counter_ns() - t0, load_ns),
+    }
+
+
+async def _pin_session_slot(model: str, sid: str, port: int, payload: Dict) -> Optional[int]:
+    """Route a session's request to its own llama.cpp slot."""
+    if RUNTIME_STATE.model_to_runtime.get(model) != "gguf":
+        return None
+    # Same session -> same llama.cpp slot, so earlier turns stay cached
+    with span("session.slot", model=model) as attrs:
+        slot, fresh, evicted = assign_slot(model, sid)
+        payload["id_slot"] = slot
+        attrs.update(slot=slot, kv_swap=bool(KV_CACHE is not None and (fresh or evicted)))
+        if attrs["kv_swap"]:
+            await asyncio.to_thread(_swap_session_kv, model, port, slot, sid if fresh else None, evicted)
+    return slot
+
+
+def _response_cache_key(model: str, payload: Dict) -> Optional[str]:
+    if RESPONSE_CACHE is None or not is_deterministic(payload):
+        return None
+    return RESPONSE_CACHE.make_key(model_digest(MODELS_DIR / model), payload)
+
+
+CACHE_LOOKUPS = METRICS.counter(
+    "zombiecoder_response_cache_lookups_total", "Response cache lookups by result (hit, miss)", ("model", "result")
+)
+
+
+def _cached_response(model: str, payload: Dict) -> Tuple[Optional[str], Optional[Dict]]:
+    """Response cache key (None when the payload is not cacheable) and cached reply."""
+    cache_key = _response_cache_key(model, payload)
+    if not cache_key:
+        return None, None
+    with span("cache.lookup", model=model) as attrs:
+        data = RESPONSE_CACHE.get(cache_key)
+        attrs["hit"] = data is not None
+    CACHE_LOOKUPS.inc(model, "miss" if data is None else "hit")
+    return cache_key, data
+
+
+def _cache_store(cache_key: Optional[str], data: Dict) -> None:
+    """Cache a completion only when it finished cleanly."""
+    if cache_key and is_complete(data):
+        RESPONSE_CACHE.put(cache_key, data)
+
+
+@app.get("/cache/response")
+async def cache_response_stats():
+    if RESPONSE_CACHE is None:
+        return {"enabled": False}
+    return {"enabled": True, **RESPONSE_CACHE.stats()}
+
+
+@app.delete("/cache/response")
+async def cache_response_clear():
+    if RESPONSE_CACHE is not None:
+        RESPONSE_CACHE.clear()
+    return {"status": "cleared"}
+
+
+# Shared system-prompt prefixes, pre-evaluated into every slot at load time
+PREFIX_WARMED: Dict[str, Dict] = {}
+
+
+def _cached_prefixes() -> List[str]:
+    cfg = _RUNTIME_CFG.get("prefix_cache", {})
+    if not cfg.get("enabled", True):
+        return []
+    prompts = [DEFAULT_SYSTEM_PROMPT] + [p for p in cfg.get("system_prompts", []) if p]
+    # Prompts are built as "{system}\n\nUser: ..."; warm up to the turn separator
+    return [f"{p}\n\n" for p in dict.fromkeys(prompts)]
+
+
+def _warm_prefix_cache(model: str) -> None:
+    """Evaluate the shared prefixes once per slot so requests only pay for their own tokens."""
+    prefixes = _cached_prefixes()
+    if not prefixes or wait_until_ready(model, 300) != "ready":
+        return
+    port = RUNTIME_STATE.model_to_port.get(model)
+    n_slots = RUNTIME_STATE.model_to_slots.get(model, 1)
+    t0 = time.time()
+    warmed = 0
+    for slot in range(n_slots):
+        payload = {"prompt": prefixes[slot % len(prefixes)], "n_predict": 0, "cache_prompt": True, "id_slot": slot}
+        try:
+            _collect_completion(port, payload, threading.Event(), {})
+            warmed += 1
+        except Exception:
+            continue
+    PREFIX_WARMED[model] = {
+        "port": port,
+        "slots_warmed": warmed,
+        "prefixes": len(prefixes),
+        "duration_ms": int((time.time() - t0) * 1000),
+        "at": datetime.now().isoformat(),
+    }
+
+
+@app.get("/cache/prefix")
+async def cache_prefix_stats():
+    return {"prefixes": len(_cached_prefixes()), "models": PREFIX_WARMED}
+
+
+def _swap_session_kv(model: str, port: int, slot: int, resumed: Optional[str], evicted: Optional[str]) -> None:
+    """Save the evicted session's slot state, then restore the resuming one's."""
+    if evicted:
+        KV_CACHE.save(model, port, slot, evicted)
+    if resumed and KV_CACHE.has(model, resumed):
+        KV_CACHE.restore(model, port, slot, resumed)
+
 
+def _save_model_sessions(model: str) -> None:
+    """Unload hook: persist every pinned session's KV cache of the model."""
+    port = RUNTIME_STATE.model_to_port.get(model)
+    if KV_CACHE is None or not port or RUNTIME_STATE.model_to_runtime.get(model) != "gguf":
+        return
+    for sid, slot in list(RUNTIME_STATE.session_slots.get(model, {}).items()):
+        KV_CACHE.save(model, port, slot, sid)
 
-# Simple in-memory sessions
-SESSIONS: Dict[str, Dict] = {}
 
+register_unload_hook(_save_model_sessions)
 
-def _session_touch(session_id: str, last_model: Optional[str] = None) -> None:
-    now = datetime.now().isoformat()
-    s = SESSIONS.get(session_id) or {"session_id": session_id, "created_at": now}
-    s["last_seen_at"] = now
-    if last_model:
-        s["last_model"] = last_model
-    SESSIONS[session_id] = s
+
+@app.get("/cache/kv")
+async def cache_kv_stats():
+    if KV_CACHE is None:
+        return {"enabled": False}
+    return {"enabled": True, **KV_CACHE.stats()}
+
+
+# Bounded sessions: TTL expiry, LRU size cap, optional SQLite persistence
+_SESS_CFG = _RUNTIME_CFG.get("sessions", {})
+SESSIONS = SessionStore(
+    ttl_sec=int(_SESS_CFG.get("ttl_sec", 86400)),
+    max_sessions=int(_SESS_CFG.get("max_sessions", 10000)),
+    db_path=DB_PATH if _SESS_CFG.get("persist", False) else None,
+)
+
+
+def _session_touch(
+    session_id: str,
+    last_model: Optional[str] = None,
+    slot: Optional[int] = None,
+    runtime_pid: Optional[int] = None,
+) -> None:
+    SESSIONS.touch(session_id, last_model=last_model, slot=slot, runtime_pid=runtime_pid)
 
 
 class StartSessionRequest(BaseModel):
@@ -780,7 +1637,7 @@ class StartSessionRequest(BaseModel):
 
 @app.post("/api/session/start")
 async def api_session_start(req: StartSessionRequest):
-    sid = req.session_id or f"sess-{int(time.time())}"
+    sid = req.session_id or SESSIONS.new_id()
     _session_touch(sid)
     return {"session_id": sid, "status": "active"}
 
@@ -790,24 +1647,600 @@ async def api_session_status(session_id: str):
     s = SESSIONS.get(session_id)
     if not s:
         raise HTTPException(status_code=404, detail="session not found")
-    return {"session": s, "status": "active"}
+    return {"session": s.to_dict(), "status": "active"}
+
+
+@app.get("/api/session/stats")
+async def api_session_stats():
+    return SESSIONS.stats()
 
 
 @app.post("/api/session/end/{session_id}")
 async def api_session_end(session_id: str):
-    if session_id in SESSIONS:
-        SESSIONS.pop(session_id, None)
+    s = SESSIONS.pop(session_id)
+    if s is not None:
+        if KV_CACHE is not None and s.last_model:
+            KV_CACHE.drop(s.last_model, session_id)
         return {"session_id": session_id, "status": "ended"}
     return {"session_id": session_id, "status": "not_found"}
 
 
+# Tokens reserved for the prompt template around the chat turns
+CHAT_TEMPLATE_OVERHEAD = 32
+
+
+def _int_option(options: Optional[Dict], key: str, default: Optional[int] = None) -> Optional[int]:
+    """Integer Ollama option; None means the default (as in _completion_payload)."""
+    value = (options or {}).get(key)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"options.{key} must be a number, got {value!r}")
+
+
+def _context_limit(model: str, options: Optional[Dict]) -> int:
+    """Per-request context window: num_ctx, runtime slot ctx and trained ctx."""
+    limits: List[int] = []
+    num_ctx = _int_option(options, "num_ctx")
+    if num_ctx:
+        limits.append(num_ctx)
+    ctx = RUNTIME_STATE.model_to_ctx.get(model)
+    if ctx:
+        # llama.cpp splits the context between parallel slots
+        limits.append(ctx // RUNTIME_STATE.model_to_slots.get(model, 1))
+    ggufs = sorted((MODELS_DIR / model).glob("*.gguf"))
+    if ggufs:
+        trained = gguf_context_length(str(ggufs[0]))
+    else:
+        trained = config_context_length(str(MODELS_DIR / model))
+    if trained:
+        limits.append(trained)
+    return min(limits) if limits else 2048
+
+
+def _count_tokens(port: int, text: str) -> int:
+    try:
+        r = httpx.post(f"http://127.0.0.1:{port}/tokenize", json={"content": text}, timeout=10)
+        if r.status_code == 200:
+            return len(r.json().get("tokens", []))
+    except Exception:
+        pass
+    return len(text) // 4 + 1
+
+
+def _session_chat_messages(model: str, port: int, sid: str, new: List[Dict], options: Optional[Dict]) -> List[Dict]:
+    """Append new messages to the session history, trimmed to the token budget."""
+    s = SESSIONS.touch(sid, last_model=model)
+    for m in new:
+        m["tokens"] = _count_tokens(port, m["content"])
+    history = list(s.history)
+    if any(m["role"] == "system" for m in new):
+        history = [m for m in history if m["role"] != "system"]
+    messages = history + new
+    n_predict = _int_option(options, "num_predict", DEFAULT_NUM_PREDICT)
+    limit = _context_limit(model, options)
+    reserve = n_predict if n_predict > 0 else limit // 4
+    budget = limit - reserve - CHAT_TEMPLATE_OVERHEAD
+    system = [m for m in messages if m["role"] == "system"]
+    turns = [m for m in messages if m["role"] != "system"]
+    used = sum(m["tokens"] for m in system + turns)
+    if used > budget:
+        # Drop oldest turns down to 75% of the budget, so the prompt prefix
+        # (and the slot's KV cache) stays stable for the next few turns
+        target = int(budget * 0.75)
+        while turns[:-1] and used > target:
+            used -= turns.pop(0)["tokens"]
+        # Never start the kept history with an orphaned assistant reply
+        while turns[:-1] and turns[0]["role"] == "assistant":
+            used -= turns.pop(0)["tokens"]
+    return system + turns
+
+
 @app.post("/api/chat")
-async def api_chat(req: ChatRequest):
+async def api_chat(req: ChatRequest, request: Request):
+    _require_installed(req.model)
+    t0 = time.perf_counter_ns()
+    messages = [{"role": m.role, "content": m.content} for m in req.messages]
+    port = None
+    load_ns = 0
+    if req.session_id:
+        port, load_ns = await _ensure_runtime_timed(req.model)
+        with span("session.history", model=req.model):
+            messages = await asyncio.to_thread(
+                _session_chat_messages, req.model, port, req.session_id, messages, req.options
+            )
+    payload = _completion_payload(_chat_prompt(messages), req.options)
+    cache_key, data = _cached_response(req.model, payload)
+    cached = data is not None
+    if data is None:
+        if port is None:
+            port, load_ns = await _ensure_runtime_timed(req.model)
+        if req.session_id:
+            slot = await _pin_session_slot(req.model, req.session_id, port, payload)
+            if slot is not None:
+                _session_touch(req.session_id, slot=slot, runtime_pid=RUNTIME_STATE.model_to_pid.get(req.model))
+        data = await _proxy_completion(request, req.model, port, payload)
+        _cache_store(cache_key, data)
+    content = data.get("content", "")
+    if req.session_id:
+        with span("postprocess"):
+            tokens = data.get("tokens_predicted") or len(content) // 4 + 1
+            messages.append({"role": "assistant", "content": content, "tokens": tokens})
+            SESSIONS.set_history(req.session_id, messages)
+    return {
+        "model": req.model,
+        "created_at": datetime.now().isoformat(),
+        "message": {"role": "assistant", "content": content},
+        "done": True,
+        "runtime_port": port,
+        "runtime_response": data,
+        "cached": cached,
+        **_ollama_metrics(data, time.perf_counter_ns() - t0, load_ns, cached=cached),
+    }
+
+
+# ------------------------
+# OpenAI-compatible endpoints
+# ------------------------
+
+class OpenAIMessage(BaseModel):
+    role: str
+    content: Union[str, List[Dict], None] = None
+
+
+class OpenAIChatRequest(BaseModel):
+    model: str
+    messages: List[OpenAIMessage]
+    max_tokens: Optional[int] = None
+    max_completion_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    stop: Union[str, List[str], None] = None
+    seed: Optional[int] = None
+    frequency_penalty: Optional[float] = None
+    presence_penalty: Optional[float] = None
+    stream: bool = False
+    stream_options: Optional[Dict] = None
+
+
+class OpenAICompletionRequest(BaseModel):
+    model: str
+    prompt: Union[str, List[str]]
+    max_tokens: Optional[int] = 16
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    stop: Union[str, List[str], None] = None
+    seed: Optional[int] = None
+    frequency_penalty: Optional[float] = None
+    presence_penalty: Optional[float] = None
+    stream: bool = False
+    stream_options: Optional[Dict] = None
+
+
+def _openai_payload(req, prompt: str, templated: bool) -> Dict:
+    max_tokens = getattr(req, "max_completion_tokens", None) or req.max_tokens
+    options = {
+        "num_predict": max_tokens if max_tokens is not None else -1,
+        "temperature": req.temperature,
+        "top_p": req.top_p,
+        "stop": req.stop,
+        "seed": req.seed,
+    }
+    payload = _completion_payload(prompt, options, templated=templated)
+    # llama.cpp understands the OpenAI penalty names directly
+    if req.frequency_penalty is not None:
+        payload["frequency_penalty"] = req.frequency_penalty
+    if req.presence_penalty is not None:
+        payload["presence_penalty"] = req.presence_penalty
+    return payload
+
+
+def _openai_text(content: Union[str, List[Dict], None]) -> str:
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if part.get("type") == "text")
+
+
+def _openai_usage(data: Dict) -> Dict:
+    prompt_tokens = int(data.get("tokens_evaluated") or 0)
+    completion_tokens = int(data.get("tokens_predicted") or 0)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _finish_reason(data: Dict) -> str:
+    return "length" if data.get("stopped_limit") else "stop"
+
+
+def _sse(obj) -> str:
+    return f"data: {json.dumps(obj, ensure_ascii=False)}\n\n"
+
+
+async def _run_completion(request: Request, model: str, payload: Dict) -> Dict:
+    """Non-streaming completion with response cache and auto-load."""
+    cache_key, data = _cached_response(model, payload)
+    if data is not None:
+        return data
+    port = await ensure_runtime(model)
+    data = await _proxy_completion(request, model, port, payload)
+    _cache_store(cache_key, data)
+    return data
+
+
+async def _openai_stream(model: str, port: int, payload: Dict, make_chunk, include_usage: bool) -> AsyncIterator[str]:
+    """Translate runtime chunks into OpenAI SSE events."""
+    last: Dict = {}
+    try:
+        async for chunk in _stream_completion(model, port, payload):
+            last = chunk
+            if chunk.get("content"):
+                yield _sse(make_chunk(chunk["content"], None))
+    except HTTPException as e:
+        yield _sse({"error": {"message": str(e.detail), "type": "runtime_error", "code": e.status_code}})
+        return
+    yield _sse(make_chunk(None, _finish_reason(last)))
+    if include_usage:
+        yield _sse({**make_chunk(None, None), "choices": [], "usage": _openai_usage(last)})
+    yield "data: [DONE]\n\n"
+
+
+@app.get("/v1/models")
+async def openai_models():
     scanned = scan_models_directory(MODELS_DIR)
-    if not any(m["name"] == req.model for m in scanned):
-        raise HTTPException(status_code=404, detail=f"Model '{req.model}' not found")
-    # Do not return synthetic chat; enforce no-demo policy
-    raise HTTPException(status_code=501, detail="Chat disabled until inference runtime is enabled.")
+    return {
+        "object": "list",
+        "data": [
+            {
+                "id": m["name"],
+                "object": "model",
+                "created": int(Path(m["path"]).stat().st_mtime),
+                "owned_by": "zombiecoder-local",
+            }
+            for m in scanned
+        ],
+    }
+
+
+@app.post("/v1/chat/completions")
+async def openai_chat_completions(req: OpenAIChatRequest, request: Request):
+    _require_installed(req.model)
+    messages = [{"role": m.role, "content": _openai_text(m.content)} for m in req.messages]
+    payload = _openai_payload(req, _chat_prompt(messages), templated=True)
+    cid = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    if req.stream:
+        port = await ensure_runtime(req.model)
+        first = [True]
+
+        def make_chunk(content, finish_reason):
+            delta: Dict = {}
+            if first[0]:
+                delta["role"] = "assistant"
+                first[0] = False
+            if content is not None:
+                delta["content"] = content
+            return {
+                "id": cid,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": req.model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+
+        include_usage = bool((req.stream_options or {}).get("include_usage"))
+        return StreamingResponse(
+            _openai_stream(req.model, port, payload, make_chunk, include_usage),
+            media_type="text/event-stream",
+        )
+
+    data = await _run_completion(request, req.model, payload)
+    return {
+        "id": cid,
+        "object": "chat.completion",
+        "created": created,
+        "model": req.model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": data.get("content", "")},
+            "finish_reason": _finish_reason(data),
+        }],
+        "usage": _openai_usage(data),
+    }
+
+
+@app.post("/v1/completions")
+async def openai_completions(req: OpenAICompletionRequest, request: Request):
+    _require_installed(req.model)
+    prompts = [req.prompt] if isinstance(req.prompt, str) else list(req.prompt)
+    cid = f"cmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    if req.stream:
+        if len(prompts) != 1:
+            raise HTTPException(status_code=400, detail="stream=true supports a single prompt")
+        port = await ensure_runtime(req.model)
+
+        def make_chunk(content, finish_reason):
+            return {
+                "id": cid,
+                "object": "text_completion",
+                "created": created,
+                "model": req.model,
+                "choices": [{"index": 0, "text": content or "", "finish_reason": finish_reason}],
+            }
+
+        include_usage = bool((req.stream_options or {}).get("include_usage"))
+        payload = _openai_payload(req, prompts[0], templated=False)
+        return StreamingResponse(
+            _openai_stream(req.model, port, payload, make_chunk, include_usage),
+            media_type="text/event-stream",
+        )
+
+    # Prompts run concurrently so parallel llama.cpp slots are used
+    results = await asyncio.gather(*[
+        _run_completion(request, req.model, _openai_payload(req, p, templated=False)) for p in prompts
+    ])
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    for data in results:
+        for k, v in _openai_usage(data).items():
+            usage[k] += v
+    return {
+        "id": cid,
+        "object": "text_completion",
+        "created": created,
+        "model": req.model,
+        "choices": [
+            {"index": i, "text": data.get("content", ""), "finish_reason": _finish_reason(data), "logprobs": None}
+            for i, data in enumerate(results)
+        ],
+        "usage": usage,
+    }
+
+
+# Inputs per upstream embedding request. Chunks are sent concurrently so
+# llama.cpp spreads them over its parallel slots and batches each one.
+EMBED_CHUNK_SIZE = 256
+
+
+class EmbedRequest(BaseModel):
+    model: str
+    input: Union[str, List[str]]
+
+
+class OpenAIEmbeddingRequest(BaseModel):
+    model: str
+    input: Union[str, List[str]]
+    encoding_format: str = "float"
+
+
+def _embed_chunk(model: str, port: int, texts: List[str]) -> Tuple[List[List[float]], int]:
+    """Embed one chunk on the runtime; returns (vectors in input order, prompt tokens)."""
+    r = httpx.post(f"http://127.0.0.1:{port}/v1/embeddings", json={"input": texts}, timeout=(5, 300))
+    if r.status_code == 501:
+        # llama.cpp only serves embeddings when started with --embedding
+        raise HTTPException(
+            status_code=400,
+            detail=f"Runtime for '{model}' is not in embedding mode; set \"embedding\": true in its runtime profile and reload",
+        )
+    if r.status_code != 200:
+        raise HTTPException(status_code=502, detail=f"Runtime error {r.status_code}: {r.text[:200]}")
+    data = r.json()
+    rows = sorted(data.get("data", []), key=lambda d: d.get("index", 0))
+    return [row["embedding"] for row in rows], int((data.get("usage") or {}).get("prompt_tokens") or 0)
+
+
+async def _embed(model: str, port: int, texts: List[str]) -> Tuple[List[List[float]], int]:
+    chunks = [texts[i:i + EMBED_CHUNK_SIZE] for i in range(0, len(texts), EMBED_CHUNK_SIZE)]
+    try:
+        results = await asyncio.gather(*[asyncio.to_thread(_embed_chunk, model, port, c) for c in chunks])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Proxy error: {e}")
+    try:
+        mark_access(model)
+    except Exception:
+        pass
+    vectors: List[List[float]] = []
+    tokens = 0
+    for chunk_vectors, chunk_tokens in results:
+        vectors.extend(chunk_vectors)
+        tokens += chunk_tokens
+    return vectors, tokens
+
+
+@app.post("/api/embed")
+async def api_embed(req: EmbedRequest):
+    """Ollama-compatible embeddings for one or many inputs"""
+    _require_installed(req.model)
+    texts = [req.input] if isinstance(req.input, str) else list(req.input)
+    t0 = time.perf_counter_ns()
+    port = await ensure_runtime(req.model)
+    load_ns = time.perf_counter_ns() - t0
+    vectors, tokens = await _embed(req.model, port, texts) if texts else ([], 0)
+    return {
+        "model": req.model,
+        "embeddings": vectors,
+        "total_duration": time.perf_counter_ns() - t0,
+        "load_duration": load_ns,
+        "prompt_eval_count": tokens,
+    }
+
+
+@app.post("/v1/embeddings")
+async def openai_embeddings(req: OpenAIEmbeddingRequest):
+    if req.encoding_format not in ("float", "base64"):
+        raise HTTPException(status_code=400, detail="encoding_format must be 'float' or 'base64'")
+    _require_installed(req.model)
+    texts = [req.input] if isinstance(req.input, str) else list(req.input)
+    if not texts:
+        raise HTTPException(status_code=400, detail="input must not be empty")
+    port = await ensure_runtime(req.model)
+    vectors, tokens = await _embed(req.model, port, texts)
+    if req.encoding_format == "base64":
+        # Little-endian float32, as the OpenAI SDKs decode it
+        vectors = [base64.b64encode(array("f", v).tobytes()).decode("ascii") for v in vectors]
+    return {
+        "object": "list",
+        "model": req.model,
+        "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+# ------------------------------
+# Offline batch jobs (JSONL in, JSONL out)
+# ------------------------------
+
+class BatchStartRequest(BaseModel):
+    model: str
+    input_path: str
+    output_path: Optional[str] = None
+    concurrency: Optional[int] = None
+
+
+def _batch_submit(default_model: str, installed: Set[str], loop: asyncio.AbstractEventLoop):
+    """Build the per-record submit function for a batch job (runs in worker threads)."""
+
+    def submit(record: Dict, cancel: threading.Event) -> Dict:
+        t0 = time.perf_counter_ns()
+        model = record.get("model") or default_model
+        if model not in installed:
+            raise ValueError(f"model '{model}' is not installed")
+        if "messages" in record:
+            prompt = _chat_prompt(record["messages"])
+        elif "prompt" in record:
+            prompt = _generate_prompt(record["prompt"], record.get("system"))
+        else:
+            raise ValueError("record needs 'prompt' or 'messages'")
+        payload = _completion_payload(prompt, record.get("options"))
+        cache_key, data = _cached_response(model, payload)
+        cached = data is not None
+        load_ns = 0
+        if data is None:
+            # Joins an in-progress load; reloads if the idle killer stopped it
+            port, load_ns = asyncio.run_coroutine_threadsafe(_ensure_runtime_timed(model), loop).result()
+            handle: Dict = {}
+            with _completion_metrics(model, handle):
+                data = _collect_completion(port, payload, cancel, handle)
+            _cache_store(cache_key, data)
+            try:
+                mark_access(model)
+            except Exception:
+                pass
+        metrics = _ollama_metrics(data, time.perf_counter_ns() - t0, load_ns, cached=cached)
+        return make_result(record, model, data.get("content", ""), metrics)
+
+    return submit
+
+
+def _batch_path(value: str) -> Path:
+    """Resolve a path relative to BATCH_DIR; absolute paths and '..' are refused."""
+    path = Path(value)
+    if not value or path.is_absolute() or ".." in path.parts:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch paths must be relative to {BATCH_DIR.relative_to(ROOT_DIR)}/ and must not contain '..': {value}",
+        )
+    resolved = (BATCH_DIR / path).resolve()
+    # Symlinks must not lead out of the batch directory either
+    if BATCH_DIR.resolve() not in resolved.parents:
+        raise HTTPException(status_code=400, detail=f"Batch path escapes {BATCH_DIR.relative_to(ROOT_DIR)}/: {value}")
+    return resolved
+
+
+@app.post("/batch/start")
+async def batch_start(req: BatchStartRequest):
+    """Run a JSONL file of generate/chat requests in the background.
+
+    input_path and output_path are relative to data/batch/. Starting again
+    with the same output_path resumes an interrupted job.
+    """
+    input_path = _batch_path(req.input_path)
+    if not input_path.is_file():
+        raise HTTPException(status_code=404, detail=f"Input file not found: {req.input_path}")
+    output_path = _batch_path(req.output_path) if req.output_path else input_path.with_suffix(".results.jsonl")
+    _require_installed(req.model)
+    installed = {m["name"] for m in scan_models_directory(MODELS_DIR)}
+    unknown = await asyncio.to_thread(record_models, input_path) - installed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Records name models that are not installed: {sorted(unknown)}")
+    # Load up front so load errors surface here, and size concurrency to the slots
+    await ensure_runtime(req.model)
+    concurrency = req.concurrency or RUNTIME_STATE.model_to_slots.get(req.model) or 4
+    submit = _batch_submit(req.model, installed, asyncio.get_running_loop())
+    return BATCH_JOBS.start(req.model, input_path, output_path, submit, concurrency)
+
+
+@app.get("/batch/status/{job_id}")
+async def batch_status(job_id: str):
+    res = BATCH_JOBS.status(job_id)
+    if res.get("status") == "absent":
+        raise HTTPException(status_code=404, detail=f"Batch job '{job_id}' not found")
+    return res
+
+
+@app.get("/batch/jobs")
+async def batch_jobs():
+    return BATCH_JOBS.list()
+
+
+@app.post("/batch/cancel/{job_id}")
+async def batch_cancel(job_id: str):
+    return BATCH_JOBS.cancel(job_id)
+
+
+# ------------------------
+# Prometheus metrics
+# ------------------------
+
+def _state_metrics():
+    """Gauges and counters read from state that already exists elsewhere."""
+    runtimes = runtime_status().get("models", [])
+    yield (
+        "zombiecoder_runtime_ready",
+        "gauge",
+        "1 while the model's runtime is ready",
+        [({"model": m["model"], "runtime": m["runtime"]}, int(m["status"] == "ready")) for m in runtimes],
+    )
+    yield (
+        "zombiecoder_runtime_slots",
+        "gauge",
+        "Parallel slots of each started runtime",
+        [({"model": m}, n) for m, n in sorted(RUNTIME_STATE.model_to_slots.items())],
+    )
+    if RESPONSE_CACHE is not None:
+        rc = RESPONSE_CACHE.stats()
+        yield ("zombiecoder_response_cache_hits_total", "counter", "Response cache hits by tier", [
+            ({"tier": "memory"}, rc["hits"]),
+            ({"tier": "disk"}, rc["disk_hits"]),
+        ])
+        yield ("zombiecoder_response_cache_misses_total", "counter", "Response cache misses", [({}, rc["misses"])])
+        yield ("zombiecoder_response_cache_entries", "gauge", "Response cache entries in memory", [({}, rc["entries"])])
+    if KV_CACHE is not None:
+        yield ("zombiecoder_kv_cache_saves_total", "counter", "Session KV caches saved to disk", [({}, KV_CACHE.saves)])
+        yield ("zombiecoder_kv_cache_restores_total", "counter", "Session KV caches restored into a slot", [({}, KV_CACHE.restores)])
+    yield ("zombiecoder_sessions_active", "gauge", "Live chat sessions", [({}, SESSIONS.stats()["active"])])
+    running = sum(1 for job in list(BATCH_JOBS.jobs.values()) if job.is_running())
+    yield ("zombiecoder_batch_jobs_running", "gauge", "Batch jobs in progress", [({}, running)])
+
+
+METRICS.add_collector(_state_metrics)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition; rendered off the event loop"""
+    body = await asyncio.to_thread(METRICS.render)
+    return Response(content=body, media_type=METRICS_CONTENT_TYPE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Statistical sampling profiler for the gateway process.
+
+Nothing runs until a profile is requested: sample() starts one thread that
+reads every thread's current frame (sys._current_frames) at a fixed
+interval for a bounded time, then stops. Stacks are folded into the
+collapsed format ("thread;outer (file:line);inner (file:line) count") that
+flamegraph.pl, speedscope and inferno read directly.
+"""
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+MAX_DURATION_SEC = 60
+MIN_INTERVAL_MS = 1
+
+# One profile at a time: two samplers would each see the other in every stack
+_PROFILE_LOCK = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    """Another profile is already running."""
+
+
+def _frame_label(code, lineno: int) -> str:
+    path = Path(code.co_filename)
+    # "package/module.py" is enough to tell frames apart without full paths
+    short = "/".join(path.parts[-2:]) if len(path.parts) > 1 else path.name
+    return f"{code.co_name} ({short}:{lineno})"
+
+
+def _collapse(frame, max_depth: int) -> List[str]:
+    stack = []
+    while frame is not None and len(stack) < max_depth:
+        stack.append(_frame_label(frame.f_code, frame.f_lineno))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def sample(duration_sec: float = 10, interval_ms: float = 10, max_depth: int = 128) -> Dict:
+    """Sample all threads for duration_sec; return folded stack counts.
+
+    Blocks the calling thread for the duration (run it off the event loop).
+    The sampler thread itself is left out of the profile.
+    """
+    duration_sec = min(max(float(duration_sec), 0.1), MAX_DURATION_SEC)
+    interval = max(float(interval_ms), MIN_INTERVAL_MS) / 1000.0
+    if not _PROFILE_LOCK.acquire(blocking=False):
+        raise ProfilerBusy("a profile is already running")
+    try:
+        stacks: Counter = Counter()
+        per_thread: Counter = Counter()
+        taken = {"samples": 0}
+        sampler_ident: Dict[str, Optional[int]] = {"ident": None}
+
+        def _run() -> None:
+            sampler_ident["ident"] = threading.get_ident()
+            deadline = time.perf_counter() + duration_sec
+            next_at = time.perf_counter()
+            while next_at < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == sampler_ident["ident"]:
+                        continue
+                    name = names.get(ident, f"thread-{ident}")
+                    stacks[";".join([name] + _collapse(frame, max_depth))] += 1
+                    per_thread[name] += 1
+                taken["samples"] += 1
+                # Fixed schedule, so a slow sample does not stretch the interval
+                next_at += interval
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_at = time.perf_counter()
+
+        t0 = time.perf_counter()
+        sampler = threading.Thread(target=_run, name="profiler-sampler", daemon=True)
+        sampler.start()
+        sampler.join()
+        return {
+            "duration_sec": round(time.perf_counter() - t0, 3),
+            "interval_ms": interval * 1000,
+            "samples": taken["samples"],
+            "threads": dict(per_thread.most_common()),
+            "stacks": dict(stacks),
+        }
+    finally:
+        _PROFILE_LOCK.release()
+
+
+def collapsed(profile: Dict) -> str:
+    """Folded-stack text, one "stack count" line per distinct stack."""
+    lines = [f"{stack} {count}" for stack, count in sorted(profile["stacks"].items())]
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+def is_running() -> bool:
+    return _PROFILE_LOCK.locked()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Exact-match response cache for deterministic completions.
+
+Entries are keyed by (model digest, rendered prompt, sampling options) and
+kept in an in-memory LRU; an optional on-disk tier keeps JSON copies that
+survive restarts.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+# Payload fields that do not change the generated text
+_IGNORED_KEYS = {"stream", "cache_prompt", "id_slot"}
+
+
+def is_deterministic(payload: Dict) -> bool:
+    """Greedy decoding or a fixed seed gives a repeatable completion.
+
+    Options arrive unvalidated from clients; values that are not numbers
+    make the request uncacheable rather than failing it here.
+    """
+    temperature = payload.get("temperature")
+    seed = payload.get("seed")
+    try:
+        return (temperature is not None and float(temperature) <= 0) or (seed is not None and int(seed) >= 0)
+    except (TypeError, ValueError):
+        return False
+
+
+def is_complete(data: Dict) -> bool:
+    """A finished, successful generation that is safe to replay.
+
+    Errors, cancelled or cut-off streams (no final stop chunk), prompts the
+    runtime truncated to fit its context and empty generations are not.
+    """
+    if data.get("error") or not data.get("stop") or data.get("truncated"):
+        return False
+    return int(data.get("tokens_predicted") or 0) > 0
+
+
+def model_digest(model_dir: Path) -> str:
+    """Cheap digest of a model's weight files (names, sizes, mtimes)."""
+    h = hashlib.sha256()
+    for f in sorted(model_dir.iterdir()) if model_dir.exists() else []:
+        if f.suffix in (".gguf", ".safetensors", ".bin") and f.is_file():
+            st = f.stat()
+            h.update(f"{f.name}:{st.st_size}:{int(st.st_mtime)}".encode("utf-8"))
+    return "sha256:" + h.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 1024, disk_dir: Optional[Path] = None, max_disk_entries: int = 10000) -> None:
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self._mem: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._disk_count = 0
+        if disk_dir is not None:
+            disk_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_count = len(list(disk_dir.glob("*/*.json")))
+
+    @staticmethod
+    def make_key(digest: str, payload: Dict) -> str:
+        opts = {k: v for k, v in payload.items() if k not in _IGNORED_KEYS}
+        raw = json.dumps([digest, opts], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            value = self._mem.get(key)
+            if value is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return value
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            try:
+                value = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                value = None
+            if value is not None:
+                self._put_mem(key, value)
+                with self._lock:
+                    self.disk_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _put_mem(self, key: str, value: Dict) -> None:
+        with self._lock:
+            self._mem[key] = value
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+                self.evictions += 1
+
+    def put(self, key: str, value: Dict) -> None:
+        self._put_mem(key, value)
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            is_new = not path.exists()
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_text(json.dumps(value, ensure_ascii=False), encoding="utf-8")
+            except OSError:
+                return
+            self._disk_count += int(is_new)
+            if self._disk_count > self.max_disk_entries:
+                self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        """Drop the oldest files down to 90% of the cap (amortizes the scan)."""
+        files = sorted(self.disk_dir.glob("*/*.json"), key=lambda p: p.stat().st_mtime)
+        keep = int(self.max_disk_entries * 0.9)
+        for p in files[: max(0, len(files) - keep)]:
+            try:
+                p.unlink()
+            except OSError:
+                pass
+        self._disk_count = min(len(files), keep)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+        if self.disk_dir is not None:
+            for p in self.disk_dir.glob("*/*.json"):
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+            self._disk_count = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._mem),
+            "max_entries": self.max_entries,
+            "disk_dir": str(self.disk_dir) if self.disk_dir else None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+        }
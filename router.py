@@ -5,11 +5,15 @@ from __future__ import annotations
 import os
 import socket
 import json
+import sys
+import threading
+from collections import Counter, OrderedDict, deque
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 import subprocess
 import time
-import socket
+import urllib.error
+import urllib.request
 from system_detector import detect_system_info
 
 
@@ -22,7 +26,16 @@ class RuntimeState:
         self.model_to_pid: Dict[str, int] = {}
         self.model_to_last_access: Dict[str, float] = {}
         self.model_to_runtime: Dict[str, str] = {}  # gguf|safetensors
+        self.pinned: set = set()  # warm set, never evicted
+        self.model_to_warm_until: Dict[str, float] = {}  # predicted-hot models kept until ts
+        self.usage: deque = deque(maxlen=20000)  # (ts, model) request history
+        self.load_locks: Dict[str, threading.Lock] = {}
+        self.model_to_slots: Dict[str, int] = {}  # llama.cpp parallel slots
+        self.model_to_ctx: Dict[str, int] = {}  # --ctx-size the runtime was started with
+        self.session_slots: Dict[str, OrderedDict] = {}  # model -> session -> slot (LRU order)
+        self.unload_hooks: List[Callable[[str], None]] = []  # run before a runtime is stopped
         self._idle_thread_started: bool = False
+        self._warm_thread_started: bool = False
 
 
 STATE = RuntimeState()
@@ -40,16 +53,115 @@ def load_runtime_config(root: Path) -> Dict:
         "runtime_rules": {
             "gguf": {
                 "engine": "llama.cpp",
-                "command": "config/llama.cpp/server.exe"
+                "command": "config/llama.cpp/server.exe",
+                "args": ["--model", "{model_path}", "--port", "{port}", "--threads", "{threads}"],
+                "option_flags": dict(DEFAULT_LLAMA_CPP_FLAGS),
             },
             "safetensors": {
                 "engine": "transformers",
-                "command": "python"
+                "command": "python",
+                "args": ["scripts/transformers_runner.py", "--model", "{model_path}", "--port", "{port}"],
+                "option_flags": {
+                    "device": "--device",
+                    "embed_batch_size": "--embed-batch-size",
+                    "parallel": "--max-batch-size",
+                    "batch_wait_ms": "--batch-wait-ms",
+                    "max_queue": "--max-queue",
+                    "quantize": "--quantize",
+                },
             }
-        }
+        },
+        "model_overrides": {},
     }
 
 
+# Runtime option -> llama.cpp flag. A string flag takes the option value
+# (booleans emit the bare flag when true); a dict maps "true"/"false" to what
+# is emitted for that value: a bare flag (mmap=false -> --no-mmap) or a
+# [flag, value] pair (flash_attn=false -> --flash-attn off).
+DEFAULT_LLAMA_CPP_FLAGS: Dict = {
+    "ctx_size": "--ctx-size",
+    "batch_size": "--batch-size",
+    "ubatch_size": "--ubatch-size",
+    "parallel": "--parallel",
+    "cont_batching": {"true": "--cont-batching", "false": "--no-cont-batching"},
+    "cache_type_k": "--cache-type-k",
+    "cache_type_v": "--cache-type-v",
+    "gpu_layers": "--n-gpu-layers",
+    "flash_attn": {"true": ["--flash-attn", "on"], "false": ["--flash-attn", "off"]},
+    "mlock": "--mlock",
+    "mmap": {"false": "--no-mmap"},
+    "slot_save_path": "--slot-save-path",
+    "embedding": "--embedding",
+    "pooling": "--pooling",
+}
+
+
+def _strip_flag(args: List[str], flag: str, takes_value: bool) -> None:
+    while flag in args:
+        i = args.index(flag)
+        del args[i:i + (2 if takes_value else 1)]
+
+
+def _apply_option(args: List[str], spec, value) -> None:
+    """Set (or replace) the flag for one runtime option inside args."""
+    if isinstance(spec, dict):
+        for emitted in spec.values():
+            if isinstance(emitted, list):
+                _strip_flag(args, emitted[0], takes_value=True)
+            else:
+                _strip_flag(args, emitted, takes_value=False)
+        emitted = spec.get("true" if value else "false")
+        if emitted:
+            args += [str(a) for a in emitted] if isinstance(emitted, list) else [emitted]
+        return
+    if isinstance(value, bool):
+        _strip_flag(args, spec, takes_value=False)
+        if value:
+            args.append(spec)
+        return
+    _strip_flag(args, spec, takes_value=True)
+    args += [spec, str(value)]
+
+
+def apply_runtime_options(args: List[str], flags: Dict, options: Optional[Dict]) -> None:
+    """Set the flags for per-model options inside args (unmapped or None options are skipped)."""
+    for key, value in (options or {}).items():
+        spec = flags.get(key)
+        if spec is None or value is None:
+            continue
+        _apply_option(args, spec, value)
+
+
+def resolve_runtime_command(root: Path, format_type: str, command: str) -> Path | str:
+    """Resolve the configured runtime command to an executable."""
+    if command == "python":
+        return sys.executable or "python"
+    if format_type == "gguf":
+        configured = root / command
+        return configured if configured.exists() else llama_server_path(root)
+    return command
+
+
+def build_runtime_command(
+    root: Path,
+    format_type: str,
+    rule: Dict,
+    values: Dict,
+    options: Optional[Dict] = None,
+) -> List[str]:
+    """Render a runtime rule's args template into a command line.
+
+    values fills the {model_path}/{port}/{threads} placeholders; options are
+    per-model settings mapped to flags via the rule's option_flags.
+    """
+    args = [str(a).format(**values) for a in rule.get("args", [])]
+    default_flags = DEFAULT_LLAMA_CPP_FLAGS if format_type == "gguf" else {}
+    apply_runtime_options(args, rule.get("option_flags", default_flags), options)
+    command = resolve_runtime_command(root, format_type, rule.get("command", ""))
+    return [str(command)] + args
+
+
 def detect_model_format(model_path: Path) -> Tuple[str, Optional[Path]]:
     """
     Detect model format and return (format_type, model_file)
@@ -112,11 +224,20 @@ def check_runtime_available(root: Path) -> Dict:
     }
 
 
-def _port_open(host: str, port: int, timeout_sec: int = 1) -> bool:
+def _runtime_ready(port: int, timeout_sec: float = 1) -> bool:
+    """True once GET /health answers 200.
+
+    llama.cpp and transformers_runner both bind their port before the model
+    is loaded and answer 503 meanwhile, so an open port is not enough.
+    Runtimes without /health (404) count as ready once they accept
+    connections.
+    """
     try:
-        with socket.create_connection((host, port), timeout=timeout_sec):
-            return True
-    except OSError:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=timeout_sec) as r:
+            return r.status == 200
+    except urllib.error.HTTPError as e:
+        return e.code == 404
+    except (OSError, ValueError):
         return False
 
 
@@ -136,8 +257,71 @@ def get_status() -> Dict:
     }
 
 
-def load_model(root: Path, model_name: str, model_path: Path, threads: int = 4) -> Dict:
-    """Load model with automatic runtime selection based on format"""
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        import psutil
+        return psutil.pid_exists(pid) and psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except Exception:
+        return False
+
+
+def load_model(
+    root: Path,
+    model_name: str,
+    model_path: Path,
+    threads: int = 4,
+    profile: Optional[Dict] = None,
+) -> Dict:
+    """Load model with automatic runtime selection based on format.
+
+    profile holds the model's persisted runtime settings; it is applied on
+    top of the model_overrides from runtime_config.json. Concurrent calls for
+    the same model are serialized, and a model that is already loading or
+    ready is not spawned a second time.
+    """
+    lock = STATE.load_locks.setdefault(model_name, threading.Lock())
+    with lock:
+        status = STATE.model_to_status.get(model_name)
+        if status in ("loading", "ready") and _pid_alive(STATE.model_to_pid.get(model_name)):
+            return {
+                "status": status,
+                "reason": "already_running",
+                "model": model_name,
+                "port": STATE.model_to_port.get(model_name),
+                "pid": STATE.model_to_pid.get(model_name),
+                "format": STATE.model_to_runtime.get(model_name),
+            }
+        return _spawn_model(root, model_name, model_path, threads, profile)
+
+
+def wait_until_ready(model_name: str, timeout_sec: float) -> str:
+    """Block until the model's runtime reports healthy; return its status."""
+    deadline = time.time() + timeout_sec
+    while True:
+        status = STATE.model_to_status.get(model_name, "stopped")
+        port = STATE.model_to_port.get(model_name)
+        if status != "loading" or not port:
+            return status
+        if _runtime_ready(port):
+            STATE.model_to_status[model_name] = "ready"
+            return "ready"
+        if not _pid_alive(STATE.model_to_pid.get(model_name)):
+            STATE.model_to_status[model_name] = "error"
+            return "error"
+        if time.time() >= deadline:
+            return status
+        time.sleep(0.5)
+
+
+def _spawn_model(
+    root: Path,
+    model_name: str,
+    model_path: Path,
+    threads: int,
+    profile: Optional[Dict],
+) -> Dict:
     
     # Detect model format
     format_type, detected_path = detect_model_format(model_path)
@@ -166,14 +350,11 @@ def load_model(root: Path, model_name: str, model_path: Path, threads: int = 4)
     if port is None:
         return {"status": "error", "reason": "no_free_port", "message": "No free port in 8080-8100"}
 
-    # Initialize variables
+    options: Dict = {}
     gpu_layers = 0
-    
-    # Build command based on format
     if format_type == "gguf":
-        # GGUF - use llama.cpp
-        server_bin = llama_server_path(root)
-        if not server_bin.exists():
+        server_bin = resolve_runtime_command(root, format_type, runtime_config.get("command", ""))
+        if not Path(server_bin).exists():
             return {
                 "status": "error",
                 "reason": "runtime_missing",
@@ -184,80 +365,65 @@ def load_model(root: Path, model_name: str, model_path: Path, threads: int = 4)
         # GPU layers heuristic
         sysinfo = detect_system_info()
         vram_mb = sysinfo.get("vram_mb") or 0
-        gpu_layers = 0
         if vram_mb >= 6144:
             gpu_layers = 40
         elif vram_mb >= 4096:
             gpu_layers = 28
         elif vram_mb >= 2048:
             gpu_layers = 16
-        
-        # llama.cpp command variants
-        base_a = [str(server_bin), "-m", str(detected_path), "-p", str(port), "-t", str(threads)]
-        base_b = [str(server_bin), "--model", str(detected_path), "--port", str(port), "--threads", str(threads)]
         if gpu_layers > 0:
-            base_a += ["-ngl", str(gpu_layers)]
-            base_b += ["--gpu-layers", str(gpu_layers)]
-        cmd_variants = [base_b, base_a]
-    
-    elif format_type == "safetensors":
-        # SafeTensors - use transformers runner
-        cmd_variants = [[
-            "python",
-            str(root / "scripts" / "transformers_runner.py"),
-            "--model", str(detected_path),
-            "--port", str(port),
-            "--device", "auto"
-        ]]
-    
-    else:
-        return {
-            "status": "error",
-            "reason": "unsupported_format",
-            "format": format_type
-        }
+            options["gpu_layers"] = gpu_layers
+
+    # Per-model overrides from runtime_config.json win over heuristics
+    options.update(config.get("model_overrides", {}).get(model_name, {}))
+    options.update({k: v for k, v in (profile or {}).items() if v is not None})
+    gpu_layers = options.get("gpu_layers", gpu_layers)
+
+    values = {"model_path": str(detected_path), "port": port, "threads": threads}
+    try:
+        cmd = build_runtime_command(root, format_type, runtime_config, values, options)
+    except (KeyError, IndexError) as e:
+        return {"status": "error", "reason": "bad_args_template", "format": format_type, "message": str(e)}
+
     # Log stdout/stderr to file for diagnostics
     logs_dir = root / "logs"
     logs_dir.mkdir(parents=True, exist_ok=True)
     runtime_log = logs_dir / f"runtime_{model_name}.log"
-    proc = None
-    used_cmd = None
-    for cmd in cmd_variants:
-        try:
-            f = open(runtime_log, "a", encoding="utf-8", errors="ignore")
-            f.write(f"# START {time.time()} cmd={' '.join(cmd)}\n")
-            proc = subprocess.Popen(
-                cmd,
-                stdout=f,
-                stderr=subprocess.STDOUT,
-                creationflags=(subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0),
-            )
-            used_cmd = cmd
-        except FileNotFoundError:
-            return {"status": "error", "reason": "bin_not_found", "path": str(server_bin)}
-        except Exception as e:
-            return {"status": "error", "reason": "spawn_failed", "message": str(e)}
-        # Quick check: if exits immediately non-zero, try next variant
-        time.sleep(0.8)
-        if proc.poll() is not None and proc.returncode != 0:
-            f.write(f"# EARLY_EXIT rc={proc.returncode}\n")
-            f.flush()
-            continue
-        break
-    if proc is None:
-        return {"status": "error", "reason": "spawn_failed", "message": "no command executed"}
+    try:
+        f = open(runtime_log, "a", encoding="utf-8", errors="ignore")
+        f.write(f"# START {time.time()} cmd={' '.join(cmd)}\n")
+        f.flush()
+        proc = subprocess.Popen(
+            cmd,
+            cwd=str(root),
+            stdout=f,
+            stderr=subprocess.STDOUT,
+            creationflags=(subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0),
+        )
+    except FileNotFoundError:
+        return {"status": "error", "reason": "bin_not_found", "path": cmd[0]}
+    except Exception as e:
+        return {"status": "error", "reason": "spawn_failed", "message": str(e)}
 
     STATE.model_to_port[model_name] = port
     STATE.model_to_pid[model_name] = proc.pid
     STATE.model_to_status[model_name] = "loading"
     STATE.model_to_last_access[model_name] = time.time()
     STATE.model_to_runtime[model_name] = format_type  # Track runtime type
+    # transformers_runner batches up to --max-batch-size (default 8) prompts
+    default_slots = 8 if format_type == "safetensors" else 1
+    STATE.model_to_slots[model_name] = max(1, int(options.get("parallel") or default_slots))
+    if "--ctx-size" in cmd[:-1]:
+        STATE.model_to_ctx[model_name] = int(cmd[cmd.index("--ctx-size") + 1])
+    else:
+        STATE.model_to_ctx.pop(model_name, None)
+    STATE.session_slots.pop(model_name, None)
 
-    # Wait briefly for port to open
+    # Wait briefly for the runtime to report healthy
     t0 = time.time()
     ready = False
     while time.time() - t0 < 20:
-        if _port_open("127.0.0.1", port, 1):
+        if _runtime_ready(port):
             ready = True
             break
         # If process exited early mark error
@@ -267,6 +433,7 @@ def load_model(root: Path, model_name: str, model_path: Path, threads: int = 4)
                 "status": "error",
                 "reason": "early_exit",
                 "code": proc.returncode,
+                "command": " ".join(cmd),
                 "log": str(runtime_log),
             }
         time.sleep(0.5)
@@ -279,7 +446,8 @@ def load_model(root: Path, model_name: str, model_path: Path, threads: int = 4)
         "model": model_name,
         "port": port,
         "pid": proc.pid,
-        "command": " ".join(used_cmd) if used_cmd else None,
+        "command": " ".join(cmd),
+        "options": options,
         "log": str(runtime_log),
         "format": format_type,
         "runtime": runtime_config.get("engine", "unknown")
@@ -292,12 +460,23 @@ def load_model(root: Path, model_name: str, model_path: Path, threads: int = 4)
     return response
 
 
+def register_unload_hook(fn: Callable[[str], None]) -> None:
+    """Call fn(model_name) before a ready runtime is stopped (unload or idle eviction)."""
+    STATE.unload_hooks.append(fn)
+
+
 def unload_model(model_name: str) -> Dict:
     pid = STATE.model_to_pid.get(model_name)
     if not pid:
         STATE.model_to_status[model_name] = "stopped"
         STATE.model_to_port.pop(model_name, None)
         return {"status": "noop", "message": "No PID", "model": model_name}
+    if STATE.model_to_status.get(model_name) == "ready":
+        for hook in list(STATE.unload_hooks):
+            try:
+                hook(model_name)
+            except Exception:
+                pass
     try:
         if os.name == "nt":
             subprocess.run(["taskkill", "/PID", str(pid), "/F"], capture_output=True)
@@ -309,9 +488,39 @@ def unload_model(model_name: str) -> Dict:
     STATE.model_to_port.pop(model_name, None)
     STATE.model_to_pid.pop(model_name, None)
     STATE.model_to_last_access.pop(model_name, None)
+    STATE.session_slots.pop(model_name, None)
     return {"status": "stopped", "model": model_name}
+
+
+def assign_slot(model_name: str, session_id: str) -> Tuple[int, bool, Optional[str]]:
+    """Pin a session to one llama.cpp slot of the model's runtime.
+
+    A session keeps its slot while the runtime lives, so the slot's prompt
+    cache still holds its previous turns. When all slots are taken the
+    least recently used session gives up its slot.
+
+    Returns (slot, newly_assigned, evicted_session_id).
+    """
+    slots = STATE.session_slots.setdefault(model_name, OrderedDict())
+    if session_id in slots:
+        slots.move_to_end(session_id)
+        return slots[session_id], False, None
+    n_slots = STATE.model_to_slots.get(model_name, 1)
+    used = set(slots.values())
+    free = [i for i in range(n_slots) if i not in used]
+    evicted = None
+    if free:
+        slot = free[0]
+    else:
+        evicted, slot = slots.popitem(last=False)
+    slots[session_id] = slot
+    return slot, True, evicted
+
+
 def mark_access(model_name: str) -> None:
-    STATE.model_to_last_access[model_name] = time.time()
+    now = time.time()
+    STATE.model_to_last_access[model_name] = now
+    STATE.usage.append((now, model_name))
 
 
 def _idle_killer_loop(timeout_sec: int = 600, check_interval_sec: int = 30) -> None:
@@ -324,6 +533,8 @@ def _idle_killer_loop(timeout_sec: int = 600, check_interval_sec: int = 30) -> N
                     continue
                 if last_ts is None:
                     continue
+                if model in STATE.pinned or now < STATE.model_to_warm_until.get(model, 0):
+                    continue
                 if now - last_ts >= timeout_sec:
                     try:
                         unload_model(model)
@@ -337,8 +548,6 @@ def _idle_killer_loop(timeout_sec: int = 600, check_interval_sec: int = 30) -> N
 def start_idle_killer(timeout_sec: int = 600, check_interval_sec: int = 30) -> None:
     if STATE._idle_thread_started:
         return
-    t = subprocess  # placeholder to keep import usage consistent
-    import threading
     th = threading.Thread(target=_idle_killer_loop, kwargs={"timeout_sec": timeout_sec, "check_interval_sec": check_interval_sec}, daemon=True)
     th.start()
     STATE._idle_thread_started = True
@@ -353,4 +562,97 @@ def stop_all_running() -> None:
                 pass
 
 
+def _seconds_of_day(ts: float) -> int:
+    t = time.localtime(ts)
+    return t.tm_hour * 3600 + t.tm_min * 60 + t.tm_sec
 
+
+def predict_models(
+    history: Iterable[Tuple[float, str]],
+    now: float,
+    horizon_sec: int = 1800,
+    history_sec: int = 7 * 86400,
+    top_n: int = 1,
+    min_requests: int = 3,
+) -> List[Tuple[str, int]]:
+    """Rank models likely to be requested within the next horizon_sec.
+
+    A request counts if it happened in the last horizon_sec, or on an earlier
+    day at a time of day inside [now, now + horizon_sec).
+    """
+    start = _seconds_of_day(now)
+    counts: Counter = Counter()
+    for ts, model in history:
+        age = now - ts
+        if age < 0 or age > history_sec:
+            continue
+        if age <= horizon_sec:
+            counts[model] += 1
+            continue
+        offset = (_seconds_of_day(ts) - start) % 86400
+        if offset < horizon_sec:
+            counts[model] += 1
+    return [(m, c) for m, c in counts.most_common(top_n) if c >= min_requests]
+
+
+def _warm_pool_loop(
+    load_fn: Callable[[str], Dict],
+    interval_sec: int,
+    horizon_sec: int,
+    history_sec: int,
+    top_n: int,
+    min_requests: int,
+    persist_fn: Optional[Callable[[List[Tuple[float, str]]], None]],
+) -> None:
+    persisted_ts = max((ts for ts, _ in STATE.usage), default=0.0)
+    while True:
+        now = time.time()
+        try:
+            if persist_fn is not None:
+                new_events = [e for e in list(STATE.usage) if e[0] > persisted_ts]
+                if new_events:
+                    persist_fn(new_events)
+                    persisted_ts = new_events[-1][0]
+            predicted = predict_models(list(STATE.usage), now, horizon_sec, history_sec, top_n, min_requests)
+            for model, _ in predicted:
+                STATE.model_to_warm_until[model] = now + horizon_sec
+            wanted = list(STATE.pinned) + [m for m, _ in predicted if m not in STATE.pinned]
+            for model in wanted:
+                if STATE.model_to_status.get(model) in ("loading", "ready"):
+                    continue
+                try:
+                    load_fn(model)
+                except Exception:
+                    pass
+        except Exception:
+            pass
+        time.sleep(interval_sec)
+
+
+def start_warm_pool(
+    load_fn: Callable[[str], Dict],
+    pinned: Iterable[str] = (),
+    history: Iterable[Tuple[float, str]] = (),
+    interval_sec: int = 300,
+    horizon_sec: int = 1800,
+    history_sec: int = 7 * 86400,
+    top_n: int = 1,
+    min_requests: int = 3,
+    persist_fn: Optional[Callable[[List[Tuple[float, str]]], None]] = None,
+) -> None:
+    """Keep pinned models resident and preload models predicted from history.
+
+    load_fn(model) loads one model; persist_fn receives newly recorded usage
+    events each round so history survives restarts.
+    """
+    STATE.pinned.update(pinned)
+    if STATE._warm_thread_started:
+        return
+    STATE.usage.extendleft(reversed(list(history)))
+    th = threading.Thread(
+        target=_warm_pool_loop,
+        args=(load_fn, interval_sec, horizon_sec, history_sec, top_n, min_requests, persist_fn),
+        daemon=True,
+    )
+    th.start()
+    STATE._warm_thread_started = True
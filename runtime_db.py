@@ -2,9 +2,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import json
 import sqlite3
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 
 
@@ -22,6 +23,17 @@ def _connect(db_path: Path) -> sqlite3.Connection:
         )
         """
     )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS runtime_profiles (
+            model TEXT PRIMARY KEY,
+            profile TEXT,
+            updated_at TEXT
+        )
+        """
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS model_usage (ts REAL, model TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_model_usage_ts ON model_usage(ts)")
     return conn
 
 
@@ -62,3 +74,64 @@ def get_all_states(db_path: Path) -> List[Dict]:
     ]
 
 
+def get_profile(db_path: Path, model: str) -> Optional[Dict]:
+    conn = _connect(db_path)
+    cur = conn.cursor()
+    cur.execute("SELECT profile FROM runtime_profiles WHERE model=?", (model,))
+    row = cur.fetchone()
+    conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def upsert_profile(db_path: Path, model: str, profile: Dict) -> None:
+    conn = _connect(db_path)
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO runtime_profiles(model, profile, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(model) DO UPDATE SET
+              profile=excluded.profile,
+              updated_at=excluded.updated_at
+            """,
+            (model, json.dumps(profile), datetime.now().isoformat()),
+        )
+    conn.close()
+
+
+def delete_profile(db_path: Path, model: str) -> None:
+    conn = _connect(db_path)
+    with conn:
+        conn.execute("DELETE FROM runtime_profiles WHERE model=?", (model,))
+    conn.close()
+
+
+def get_all_profiles(db_path: Path) -> List[Dict]:
+    conn = _connect(db_path)
+    cur = conn.cursor()
+    cur.execute("SELECT model, profile, updated_at FROM runtime_profiles")
+    rows = cur.fetchall()
+    conn.close()
+    return [
+        {"model": r[0], "profile": json.loads(r[1]), "updated_at": r[2]}
+        for r in rows
+    ]
+
+
+def append_usage(db_path: Path, events: List[Tuple[float, str]], keep_sec: int = 30 * 86400) -> None:
+    """Append (ts, model) request events and drop ones older than keep_sec."""
+    conn = _connect(db_path)
+    with conn:
+        conn.executemany("INSERT INTO model_usage(ts, model) VALUES (?, ?)", events)
+        if events:
+            conn.execute("DELETE FROM model_usage WHERE ts < ?", (events[-1][0] - keep_sec,))
+    conn.close()
+
+
+def get_usage_since(db_path: Path, since_ts: float) -> List[Tuple[float, str]]:
+    conn = _connect(db_path)
+    cur = conn.cursor()
+    cur.execute("SELECT ts, model FROM model_usage WHERE ts >= ? ORDER BY ts", (since_ts,))
+    rows = cur.fetchall()
+    conn.close()
+    return [(r[0], r[1]) for r in rows]
@@ -5,14 +5,21 @@ ZombieCoder Local AI - GGUF Model Loader
 Loads GGUF models using llama.cpp backend
 """
 
+import json
 import subprocess
 import os
+import struct
 import sys
+from functools import lru_cache
 from pathlib import Path
 import time
 import requests
 from typing import Optional, Dict
 
+# The flag map lives in router.py (repo root) so both loaders stay in sync
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from router import DEFAULT_LLAMA_CPP_FLAGS, apply_runtime_options
+
 
 def find_llama_cpp_server() -> Optional[Path]:
     """
@@ -39,8 +46,9 @@ def load_model(
     port: int = 8080,
     threads: int = 4,
     gpu_layers: int = 0,
-    context_size: int = 2048,
-    background: bool = True
+    context_size: Optional[int] = None,
+    background: bool = True,
+    profile: Optional[Dict] = None
 ) -> Dict:
     """
     Load GGUF model using llama.cpp server
@@ -50,8 +58,10 @@ def load_model(
         port: Server port
         threads: Number of CPU threads
         gpu_layers: Number of GPU layers (0 for CPU-only)
-        context_size: Context size
+        context_size: Context size (overrides profile ctx_size; llama.cpp default if unset)
         background: Run in background
+        profile: Runtime profile (any option in router.DEFAULT_LLAMA_CPP_FLAGS,
+            e.g. ctx_size, parallel, cont_batching, flash_attn)
     
     Returns:
         Dict with process info
@@ -78,11 +88,14 @@ def load_model(
         "--model", str(model_path),
         "--port", str(port),
         "--threads", str(threads),
-        "--ctx-size", str(context_size),
     ]
     
+    profile = dict(profile or {})
+    if context_size is not None:
+        profile["ctx_size"] = context_size
     if gpu_layers > 0:
-        cmd.extend(["--n-gpu-layers", str(gpu_layers)])
+        profile["gpu_layers"] = gpu_layers
+    apply_runtime_options(cmd, DEFAULT_LLAMA_CPP_FLAGS, profile)
     
     # Start process
     if background:
@@ -127,6 +140,110 @@ def load_model(
         }
 
 
+# GGUF metadata value types -> struct format (8 = string, 9 = array)
+_GGUF_SCALARS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d"}
+
+
+def _gguf_read(f, fmt: str):
+    return struct.unpack(fmt, f.read(struct.calcsize(fmt)))[0]
+
+
+def _gguf_value(f, vtype: int):
+    if vtype in _GGUF_SCALARS:
+        return _gguf_read(f, _GGUF_SCALARS[vtype])
+    if vtype == 8:
+        return f.read(_gguf_read(f, "<Q")).decode("utf-8", errors="replace")
+    if vtype == 9:
+        item_type = _gguf_read(f, "<I")
+        count = _gguf_read(f, "<Q")
+        if item_type in _GGUF_SCALARS:
+            # Skip numeric arrays (e.g. token scores) without decoding them
+            f.seek(struct.calcsize(_GGUF_SCALARS[item_type]) * count, os.SEEK_CUR)
+            return None
+        for _ in range(count):
+            _gguf_value(f, item_type)
+        return None
+    raise ValueError(f"unknown GGUF value type {vtype}")
+
+
+def read_gguf_metadata(model_path: str, stop_key: Optional[str] = None) -> Dict:
+    """
+    Read scalar/string metadata from a GGUF file header
+    
+    Args:
+        model_path: Path to GGUF model file
+        stop_key: Stop reading once a key ending with this suffix is found
+    
+    Returns:
+        Dict of metadata key -> value (arrays are skipped)
+    """
+    meta: Dict = {}
+    with open(model_path, "rb") as f:
+        if f.read(4) != b"GGUF":
+            raise ValueError(f"Not a GGUF file: {model_path}")
+        version = _gguf_read(f, "<I")
+        count_fmt = "<I" if version == 1 else "<Q"
+        _gguf_read(f, count_fmt)  # tensor count
+        kv_count = _gguf_read(f, count_fmt)
+        for _ in range(kv_count):
+            key = f.read(_gguf_read(f, count_fmt)).decode("utf-8", errors="replace")
+            value = _gguf_value(f, _gguf_read(f, "<I"))
+            if value is not None:
+                meta[key] = value
+            if stop_key and key.endswith(stop_key):
+                break
+    return meta
+
+
+@lru_cache(maxsize=64)
+def _gguf_context_length(model_path: str, mtime: float) -> Optional[int]:
+    try:
+        meta = read_gguf_metadata(model_path, stop_key=".context_length")
+    except (OSError, ValueError, struct.error):
+        return None
+    for key, value in meta.items():
+        if key.endswith(".context_length"):
+            return int(value)
+    return None
+
+
+def gguf_context_length(model_path: str) -> Optional[int]:
+    """Trained context length from GGUF metadata (cached per file version)"""
+    try:
+        mtime = Path(model_path).stat().st_mtime
+    except OSError:
+        return None
+    return _gguf_context_length(str(model_path), mtime)
+
+
+# config.json keys that hold the trained context, in order of preference
+_CONFIG_CONTEXT_KEYS = ("max_position_embeddings", "n_positions", "max_seq_len", "seq_length")
+
+
+@lru_cache(maxsize=64)
+def _config_context_length(config_path: str, mtime: float) -> Optional[int]:
+    try:
+        config = json.loads(Path(config_path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    # Multimodal configs nest the language model under text_config
+    for section in (config, config.get("text_config") or {}):
+        for key in _CONFIG_CONTEXT_KEYS:
+            if isinstance(section.get(key), int) and section[key] > 0:
+                return section[key]
+    return None
+
+
+def config_context_length(model_dir: str) -> Optional[int]:
+    """Trained context length from a safetensors model's config.json"""
+    config_path = Path(model_dir) / "config.json"
+    try:
+        mtime = config_path.stat().st_mtime
+    except OSError:
+        return None
+    return _config_context_length(str(config_path), mtime)
+
+
 def check_model_status(port: int = 8080) -> Dict:
     """
     Check if model is ready on given port
@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ZombieCoder Local AI - Runner Errors
+Exceptions shared by transformers_engine and transformers_runner.
+
+Importing them does not import torch, so the runner can catch them at
+module level and still bind its port before the engine loads.
+"""
+
+
+class RunnerBusy(Exception):
+    """The generation queue is full; the client should retry later"""
@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ZombieCoder Local AI - Transformers Engine
+Model loading, dynamic batching and embeddings for transformers_runner.
+
+Kept apart from the HTTP server so the runner can bind its port before
+torch and transformers are imported.
+"""
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+import psutil
+import torch
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    StoppingCriteria,
+    StoppingCriteriaList,
+)
+
+from runner_errors import RunnerBusy
+
+
+# Cap for n_predict=-1 ("until EOS"), matching llama.cpp's unbounded mode
+MAX_NEW_TOKENS_UNBOUNDED = 1024
+
+
+def cpu_supports_bf16() -> bool:
+    """True when the CPU does bf16 math natively (AVX512-BF16 or AMX)"""
+    for probe in ("_is_avx512_bf16_supported", "_is_amx_tile_supported"):
+        fn = getattr(torch.cpu, probe, None)
+        try:
+            if fn is not None and fn():
+                return True
+        except Exception:
+            pass
+    return False
+
+
+def rss_mb() -> float:
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+class GenerationJob:
+    """One prompt waiting for, or riding in, a batched generate() call"""
+
+    def __init__(
+        self,
+        prompt_ids: List[int],
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+        top_k: Optional[int],
+        repeat_penalty: Optional[float],
+        stop: List[str],
+        seed: Optional[int],
+        cancel: Optional[threading.Event],
+        on_text: Optional[Callable[[str], None]] = None,
+        on_done: Optional[Callable[[], None]] = None,
+    ):
+        self.prompt_ids = prompt_ids
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.repeat_penalty = repeat_penalty
+        self.stop = [s for s in stop if s]
+        self.seed = seed
+        self.cancel = cancel or threading.Event()
+        # Only the tail can contain a newly completed stop string
+        self.tail_tokens = max((len(s) for s in self.stop), default=0) + 8
+        # Streamed text stays this far behind so a forming stop string is never sent
+        self.holdback = max((len(s) for s in self.stop), default=1) - 1
+        self.on_text = on_text
+        self.on_done = on_done
+        self.sent = ""
+        self.generated: Optional[int] = None  # tokens produced when the row finished
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict] = None
+        self.error: Optional[BaseException] = None
+        self.truncated = False  # prompt was cut to fit the context
+        self.done = threading.Event()
+
+    def emit(self, text: str) -> None:
+        """Stream the part of text not yet sent (text is the full output so far)"""
+        if self.generated is None:
+            text = text[:max(0, len(text) - self.holdback)]
+            # An incomplete multi-byte character decodes as U+FFFD for now
+            text = text.rstrip("\ufffd")
+        else:
+            text, _ = truncate_at_stop(text, self.stop)
+        if len(text) > len(self.sent) and text.startswith(self.sent):
+            self.on_text(text[len(self.sent):])
+            self.sent = text
+
+    def finish(self) -> None:
+        self.done.set()
+        if self.on_done is not None:
+            self.on_done()
+
+    @property
+    def batch_key(self) -> Tuple:
+        """Jobs can share a generate() call only with identical sampling settings"""
+        if self.seed is not None and self.seed >= 0:
+            # The seed applies to the whole call; keep seeded jobs reproducible
+            return ("seed", id(self))
+        if self.temperature <= 0:
+            return ("greedy", self.repeat_penalty)
+        return ("sample", self.temperature, self.top_p, self.top_k, self.repeat_penalty)
+
+
+class BatchProgress(StoppingCriteria):
+    """Finish each row of a batch on EOS, a stop string, its own token limit
+    or cancellation; generate() stops once every row is finished."""
+
+    def __init__(self, tokenizer, jobs: List[GenerationJob], prompt_len: int, eos_ids: set):
+        self.tokenizer = tokenizer
+        self.jobs = jobs
+        self.prompt_len = prompt_len
+        self.eos_ids = eos_ids
+        # First call comes right after prefill produced the first token
+        self.first_token_at: Optional[float] = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        now = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = now
+        n = input_ids.shape[1] - self.prompt_len
+        finished = []
+        for row, job in enumerate(self.jobs):
+            if job.generated is None:
+                if int(input_ids[row, -1]) in self.eos_ids:
+                    job.generated = n - 1
+                elif n >= job.max_tokens or job.cancel.is_set():
+                    job.generated = n
+                elif job.stop:
+                    tail = input_ids[row, max(self.prompt_len, input_ids.shape[1] - job.tail_tokens):]
+                    text = self.tokenizer.decode(tail, skip_special_tokens=True)
+                    if any(s in text for s in job.stop):
+                        job.generated = n
+                if job.generated is not None:
+                    job.finished_at = now
+                if job.on_text is not None:
+                    count = job.generated if job.generated is not None else n
+                    job.emit(self.tokenizer.decode(
+                        input_ids[row, self.prompt_len:self.prompt_len + count], skip_special_tokens=True
+                    ))
+            finished.append(job.generated is not None)
+        return torch.tensor(finished, dtype=torch.bool, device=input_ids.device)
+
+
+class BatchScheduler:
+    """Collect concurrent requests into padded batches for one worker thread.
+
+    The first queued job opens a batch_wait_ms window; jobs with the same
+    sampling settings that arrive within it (up to max_batch_size) run in
+    the same generate() call.
+    """
+
+    def __init__(
+        self,
+        runner: "TransformersRunner",
+        max_batch_size: int = 8,
+        batch_wait_ms: float = 10,
+        max_queue: int = 64,
+    ):
+        self.runner = runner
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_wait_sec = max(0.0, batch_wait_ms) / 1000.0
+        self.max_queue = max(1, max_queue)
+        self.running = 0
+        self.tokens_generated = 0
+        self.generate_sec = 0.0
+        self.queue: Deque[GenerationJob] = deque()
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._loop, name="generate-worker", daemon=True)
+        self.thread.start()
+
+    def submit(self, job: GenerationJob) -> None:
+        """Queue a job; raises RunnerBusy instead of growing past max_queue"""
+        with self.cond:
+            if len(self.queue) >= self.max_queue:
+                raise RunnerBusy(f"{len(self.queue)} requests already queued")
+            self.queue.append(job)
+            self.cond.notify()
+
+    def stats(self) -> Dict:
+        return {
+            "waiting": len(self.queue),
+            "running": self.running,
+            "max_queue": self.max_queue,
+            "max_batch_size": self.max_batch_size,
+            "tokens_generated": self.tokens_generated,
+            # Aggregate decode throughput while the worker was busy
+            "tokens_per_sec": round(self.tokens_generated / self.generate_sec, 2) if self.generate_sec else None,
+        }
+
+    def _take_batch(self) -> List[GenerationJob]:
+        with self.cond:
+            while not self.queue:
+                self.cond.wait()
+            deadline = time.monotonic() + self.batch_wait_sec
+            while len(self.queue) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            key = self.queue[0].batch_key
+            batch = [j for j in self.queue if j.batch_key == key][:self.max_batch_size]
+            for job in batch:
+                self.queue.remove(job)
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            jobs = self._take_batch()
+            # Jobs cancelled while queued are finished without running
+            batch = [j for j in jobs if not j.cancel.is_set()]
+            self.running = len(batch)
+            t0 = time.perf_counter()
+            try:
+                if batch:
+                    self.runner._generate_batch(batch)
+                    self.generate_sec += time.perf_counter() - t0
+                    self.tokens_generated += sum(j.generated or 0 for j in batch)
+            except Exception as e:
+                print(f"❌ Generation failed: {e}")
+                for job in batch:
+                    job.error = e
+            finally:
+                self.running = 0
+                for job in jobs:
+                    job.finish()
+
+
+def truncate_at_stop(text: str, stop: List[str]) -> tuple:
+    """Cut text at the earliest stop string; return (text, stopping_word)"""
+    cut, word = len(text), ""
+    for s in stop:
+        i = text.find(s) if s else -1
+        if 0 <= i < cut:
+            cut, word = i, s
+    return text[:cut], word
+
+
+class TransformersRunner:
+    """Run SafeTensors models using transformers library"""
+    
+    def __init__(
+        self,
+        model_path: str,
+        device: str = "auto",
+        embed_batch_size: int = 32,
+        max_batch_size: int = 8,
+        batch_wait_ms: float = 10,
+        max_queue: int = 64,
+        quantize: str = "none",
+    ):
+        self.model_path = Path(model_path)
+        self.device = device
+        self.quantize = quantize
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.model = None
+        self.tokenizer = None
+        # Seconds spent in each load phase, reported on /health
+        self.load_timings: Dict[str, float] = {}
+        
+        print(f"🔄 Loading model from: {self.model_path}")
+        self._load_model()
+        # Generation runs on the scheduler's worker thread, never the event loop
+        self.scheduler = BatchScheduler(self, max_batch_size, batch_wait_ms, max_queue)
+        self.embed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed-worker")
+    
+    def _timed(self, phase: str, t0: float) -> float:
+        now = time.perf_counter()
+        self.load_timings[phase] = round(now - t0, 3)
+        return now
+    
+    def warmup(self) -> None:
+        """One-token generation so the first real request doesn't pay for
+        kernel selection and allocator warmup"""
+        t0 = time.perf_counter()
+        self.generate("Hello", max_tokens=1, temperature=0)
+        self._timed("warmup_sec", t0)
+    
+    def _load_model(self):
+        """Load model and tokenizer"""
+        try:
+            t0 = time.perf_counter()
+            # Load tokenizer
+            self.tokenizer = AutoTokenizer.from_pretrained(
+                str(self.model_path),
+                local_files_only=True,
+                trust_remote_code=True
+            )
+            if self.tokenizer.pad_token is None:
+                # Needed to pad batches; causal LMs often lack one
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            # Decoder-only models continue from the right edge of the prompt
+            self.tokenizer.padding_side = "left"
+            t0 = self._timed("tokenizer_sec", t0)
+            
+            # Load model (safetensors shards are memory-mapped, not read up front)
+            on_gpu = torch.cuda.is_available()
+            dtype = torch.float16 if on_gpu else torch.float32
+            if on_gpu and self.quantize != "none":
+                print(f"⚠️ --quantize {self.quantize} is for CPU hosts; loading float16 on GPU")
+                self.quantize = "none"
+            elif self.quantize == "bf16":
+                if cpu_supports_bf16():
+                    dtype = torch.bfloat16
+                else:
+                    print("⚠️ CPU has no native bf16 support; loading float32")
+                    self.quantize = "none"
+            self.model = AutoModelForCausalLM.from_pretrained(
+                str(self.model_path),
+                local_files_only=True,
+                trust_remote_code=True,
+                torch_dtype=dtype,
+                device_map=self.device,
+                low_cpu_mem_usage=True
+            )
+            t0 = self._timed("weights_sec", t0)
+            if self.quantize == "int8":
+                # int8 weights for every nn.Linear; activations are quantized on the fly
+                self.model = torch.ao.quantization.quantize_dynamic(
+                    self.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+                self._timed("quantize_sec", t0)
+            
+            print("✅ Model loaded successfully")
+            print(f"   Device: {self.device}")
+            print(f"   Model size: {self.model.num_parameters() / 1e9:.2f}B parameters")
+            print(f"   Quantize: {self.quantize} | RSS: {rss_mb():.0f} MB")
+            
+        except Exception as e:
+            print(f"❌ Failed to load model: {e}")
+            raise
+    
+    def start_generation(
+        self,
+        prompt: str,
+        max_tokens: int = 64,
+        temperature: float = 0.8,
+        top_p: float = 0.95,
+        top_k: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+        repeat_penalty: Optional[float] = None,
+        num_ctx: Optional[int] = None,
+        cancel: Optional[threading.Event] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        on_done: Optional[Callable[[], None]] = None,
+    ) -> GenerationJob:
+        """Queue a prompt for the next batch and return its job immediately.
+
+        on_text receives streamed text deltas and on_done fires once the job
+        has a result (or error); both are called from the worker thread.
+        Raises RunnerBusy when the queue is full and ValueError when the
+        prompt does not fit the context (max_position_embeddings or num_ctx).
+        """
+        stop = stop or []
+        if max_tokens is None or max_tokens < 0:
+            max_tokens = MAX_NEW_TOKENS_UNBOUNDED
+        prompt_ids = self.tokenizer.encode(prompt)
+        # Positions past max_position_embeddings crash the forward pass (and
+        # with it every other row of the batch), so never schedule them
+        ctx = getattr(self.model.config, "max_position_embeddings", None)
+        if num_ctx:
+            ctx = min(num_ctx, ctx) if ctx else num_ctx
+        truncated = False
+        if ctx:
+            if num_ctx and len(prompt_ids) + max_tokens > ctx:
+                # Keep the most recent context, like llama.cpp's context shift,
+                # leaving up to half of it for the reply
+                kept = prompt_ids[-(ctx - min(max_tokens, ctx // 2)):]
+                truncated = len(kept) < len(prompt_ids)
+                prompt_ids = kept
+            if len(prompt_ids) >= ctx:
+                raise ValueError(
+                    f"Prompt is {len(prompt_ids)} tokens but the context is {ctx} tokens; shorten it or pass num_ctx"
+                )
+            max_tokens = min(max_tokens, ctx - len(prompt_ids))
+        job = GenerationJob(
+            prompt_ids, max_tokens, temperature, top_p, top_k, repeat_penalty, stop, seed, cancel, on_text, on_done
+        )
+        job.truncated = truncated
+        if max_tokens == 0:
+            job.generated = 0
+            job.result = {"content": "", "stopped_word": False, "stopping_word": "",
+                          "tokens_evaluated": len(prompt_ids), "tokens_predicted": 0}
+            job.finish()
+        else:
+            self.scheduler.submit(job)
+        return job
+
+    @staticmethod
+    def job_result(job: GenerationJob) -> Dict:
+        """The job's result; failed or cancelled jobs carry an "error" message
+        and no content"""
+        if job.result is not None:
+            return job.result
+        error = str(job.error) if job.error is not None else "cancelled"
+        return {"content": "", "error": error, "stopped_word": False, "stopping_word": "",
+                "tokens_evaluated": len(job.prompt_ids), "tokens_predicted": 0}
+
+    def generate(self, prompt: str, **kwargs) -> Dict:
+        """Generate text (blocking); concurrent calls are batched together.
+
+        Takes the start_generation() arguments; returns content plus
+        llama.cpp-style stop info and token counts.
+        """
+        job = self.start_generation(prompt, **kwargs)
+        job.done.wait()
+        return self.job_result(job)
+
+    def _generate_batch(self, jobs: List[GenerationJob]) -> None:
+        """Run jobs (same batch_key) through one left-padded generate() call"""
+        pad_id = self.tokenizer.pad_token_id
+        width = max(len(j.prompt_ids) for j in jobs)
+        input_ids = torch.full((len(jobs), width), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(jobs), width), dtype=torch.long)
+        for row, job in enumerate(jobs):
+            input_ids[row, width - len(job.prompt_ids):] = torch.tensor(job.prompt_ids, dtype=torch.long)
+            attention_mask[row, width - len(job.prompt_ids):] = 1
+        eos = self.model.generation_config.eos_token_id
+        eos_ids = set(eos if isinstance(eos, list) else [eos]) - {None}
+        first = jobs[0]
+        kwargs = {
+            "max_new_tokens": max(j.max_tokens for j in jobs),
+            "do_sample": first.temperature > 0,
+            "pad_token_id": pad_id,
+        }
+        progress = BatchProgress(self.tokenizer, jobs, width, eos_ids)
+        kwargs["stopping_criteria"] = StoppingCriteriaList([progress])
+        if first.temperature > 0:
+            kwargs.update(temperature=first.temperature, top_p=first.top_p)
+            if first.top_k is not None:
+                kwargs["top_k"] = first.top_k
+        if first.repeat_penalty is not None:
+            kwargs["repetition_penalty"] = first.repeat_penalty
+        if first.seed is not None and first.seed >= 0:
+            torch.manual_seed(first.seed)
+        started = time.perf_counter()
+        with torch.inference_mode():
+            output = self.model.generate(
+                input_ids=input_ids.to(self.model.device),
+                attention_mask=attention_mask.to(self.model.device),
+                **kwargs,
+            )
+        ended = time.perf_counter()
+        first_token_at = progress.first_token_at or ended
+        for row, job in enumerate(jobs):
+            generated = job.generated if job.generated is not None else output.shape[1] - width
+            # llama.cpp-style timings; prefill is shared by the whole batch
+            prompt_ms = (first_token_at - started) * 1000
+            predicted_ms = ((job.finished_at or ended) - first_token_at) * 1000
+            text = self.tokenizer.decode(output[row, width:width + generated], skip_special_tokens=True)
+            text, word = truncate_at_stop(text, job.stop)
+            if job.on_text is not None:
+                job.emit(text)
+            job.result = {
+                "content": text,
+                "stopped_word": bool(word),
+                "stopping_word": word,
+                "tokens_evaluated": len(job.prompt_ids),
+                "tokens_predicted": generated,
+                "truncated": job.truncated,
+                "timings": {
+                    "prompt_n": len(job.prompt_ids),
+                    "prompt_ms": round(prompt_ms, 3),
+                    "predicted_n": generated,
+                    "predicted_ms": round(predicted_ms, 3),
+                    "predicted_per_second": round(generated * 1000 / predicted_ms, 2) if predicted_ms > 0 else None,
+                },
+            }
+
+    def embed(self, texts: List[str]) -> Dict:
+        """Mean-pooled, L2-normalised embeddings of the last hidden layer.
+
+        Inputs are sorted by length and run embed_batch_size at a time so
+        each forward pass pads as little as possible; results come back in
+        input order.
+        """
+        max_len = getattr(self.model.config, "max_position_embeddings", None) or 2048
+        encoded = [self.tokenizer.encode(t, truncation=True, max_length=max_len) for t in texts]
+        order = sorted(range(len(texts)), key=lambda i: len(encoded[i]))
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        for start in range(0, len(order), self.embed_batch_size):
+            idx = order[start:start + self.embed_batch_size]
+            batch = self.tokenizer.pad(
+                {"input_ids": [encoded[i] for i in idx]},
+                padding=True,
+                return_tensors="pt",
+            ).to(self.model.device)
+            # Positions from the mask so left padding doesn't shift them
+            positions = (batch["attention_mask"].cumsum(-1) - 1).clamp(min=0)
+            with torch.inference_mode():
+                out = self.model(**batch, position_ids=positions, output_hidden_states=True)
+            hidden = out.hidden_states[-1]
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            pooled = torch.nn.functional.normalize(pooled.float(), p=2, dim=1)
+            for i, vec in zip(idx, pooled.cpu().tolist()):
+                vectors[i] = vec
+        return {"embeddings": vectors, "prompt_tokens": sum(len(e) for e in encoded)}
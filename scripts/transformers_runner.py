@@ -5,101 +5,94 @@ ZombieCoder Local AI - Transformers Runner
 Python-based runtime for SafeTensors models
 """
 
+import os
 import sys
+import json
+import time
+import asyncio
 import argparse
+import threading
 from pathlib import Path
-from typing import Optional
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
-from fastapi import FastAPI
+from typing import Dict, List, Optional, Union
+import psutil
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
 
+from runner_errors import RunnerBusy
+
+
+# --quantize modes for CPU hosts (GPU loads stay float16)
+QUANTIZE_MODES = ("none", "int8", "bf16")
+
 
 class GenerateRequest(BaseModel):
+    """llama.cpp /completion compatible request"""
     prompt: str
-    max_tokens: int = 64
+    n_predict: Optional[int] = None
+    max_tokens: int = 64  # legacy alias for n_predict
     temperature: float = 0.8
+    top_k: Optional[int] = None
     top_p: float = 0.95
+    stop: List[str] = []
+    seed: Optional[int] = None
+    repeat_penalty: Optional[float] = None
+    num_ctx: Optional[int] = None
     stream: bool = False
 
 
-class TransformersRunner:
-    """Run SafeTensors models using transformers library"""
-    
-    def __init__(self, model_path: str, device: str = "auto"):
-        self.model_path = Path(model_path)
-        self.device = device
-        self.model = None
-        self.tokenizer = None
-        self.generator = None
-        
-        print(f"🔄 Loading model from: {self.model_path}")
-        self._load_model()
-    
-    def _load_model(self):
-        """Load model and tokenizer"""
+class TokenizeRequest(BaseModel):
+    content: str
+
+
+class EmbeddingRequest(BaseModel):
+    """OpenAI /v1/embeddings compatible request (as served by llama.cpp)"""
+    input: Union[str, List[str]]
+    model: Optional[str] = None
+
+
+class RunnerState:
+    """Load progress of the model; the HTTP server is up before the model is.
+
+    torch/transformers are imported by load() on a background thread, so
+    the port binds in well under a second and /health can say "loading".
+    """
+
+    def __init__(self, model_path: str):
+        self.model_name = Path(model_path).name
+        self.status = "loading"
+        self.runner = None
+        self.timings: Dict[str, float] = {}
+        self.started = time.perf_counter()
+
+    def load(self, **kwargs) -> None:
         try:
-            # Load tokenizer
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                str(self.model_path),
-                local_files_only=True,
-                trust_remote_code=True
-            )
-            
-            # Load model
-            self.model = AutoModelForCausalLM.from_pretrained(
-                str(self.model_path),
-                local_files_only=True,
-                trust_remote_code=True,
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                device_map=self.device,
-                low_cpu_mem_usage=True
-            )
-            
-            # Create generator
-            self.generator = pipeline(
-                "text-generation",
-                model=self.model,
-                tokenizer=self.tokenizer,
-                device_map=self.device
-            )
-            
-            print(f"✅ Model loaded successfully")
-            print(f"   Device: {self.device}")
-            print(f"   Model size: {self.model.num_parameters() / 1e9:.2f}B parameters")
-            
+            t0 = time.perf_counter()
+            from transformers_engine import TransformersRunner
+            self.timings["import_sec"] = round(time.perf_counter() - t0, 3)
+            runner = TransformersRunner(**kwargs)
+            runner.warmup()
+            self.timings.update(runner.load_timings)
+            self.timings["total_sec"] = round(time.perf_counter() - self.started, 3)
+            self.runner = runner
+            self.status = "ready"
+            print(f"✅ Ready in {self.timings['total_sec']:.1f}s {self.timings}")
         except Exception as e:
+            self.status = "error"
             print(f"❌ Failed to load model: {e}")
-            raise
-    
-    def generate(
-        self,
-        prompt: str,
-        max_tokens: int = 64,
-        temperature: float = 0.8,
-        top_p: float = 0.95
-    ) -> str:
-        """Generate text"""
-        try:
-            result = self.generator(
-                prompt,
-                max_new_tokens=max_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                do_sample=True,
-                return_full_text=False
-            )
-            
-            return result[0]['generated_text']
-            
-        except Exception as e:
-            print(f"❌ Generation failed: {e}")
-            return f"Error: {str(e)}"
+            # Exit like a failed synchronous load would; the router sees the dead pid
+            os._exit(1)
 
+    def require(self):
+        """The loaded runner, or 503 "Loading model" (same wording as llama.cpp)"""
+        if self.runner is None:
+            raise HTTPException(status_code=503, detail="Loading model")
+        return self.runner
 
-def create_server(runner: TransformersRunner, port: int = 8080):
+
+def create_server(state: RunnerState, port: int = 8080):
     """Create FastAPI server for transformers runner"""
     
     app = FastAPI(title="Transformers Runner")
@@ -115,30 +108,130 @@ def create_server(runner: TransformersRunner, port: int = 8080):
     
     @app.get("/health")
     async def health():
-        return {
-            "status": "healthy",
+        """200 once the model is ready; 503 while loading (like llama.cpp)"""
+        info = {
+            "status": "healthy" if state.status == "ready" else state.status,
             "runtime": "transformers",
-            "model": str(runner.model_path.name)
+            "model": state.model_name,
+            "memory_rss_mb": round(psutil.Process().memory_info().rss / (1024 * 1024), 1),
+            "load_timings": state.timings,
         }
+        if state.runner is None:
+            info["elapsed_sec"] = round(time.perf_counter() - state.started, 3)
+            return JSONResponse(status_code=503, content=info)
+        info["quantize"] = state.runner.quantize
+        info["queue"] = state.runner.scheduler.stats()
+        return info
     
-    @app.post("/completion")
-    async def completion(req: GenerateRequest):
-        """Generate completion (llama.cpp compatible endpoint)"""
-        generated = runner.generate(
-            prompt=req.prompt,
-            max_tokens=req.max_tokens,
-            temperature=req.temperature,
-            top_p=req.top_p
-        )
-        
+    @app.post("/tokenize")
+    async def tokenize(req: TokenizeRequest):
+        """Tokenize text (llama.cpp compatible endpoint)"""
+        runner = state.require()
+        return {"tokens": runner.tokenizer.encode(req.content, add_special_tokens=False)}
+    
+    @app.post("/v1/embeddings")
+    async def embeddings(req: EmbeddingRequest):
+        """Embed one or many inputs (llama.cpp compatible endpoint)"""
+        runner = state.require()
+        texts = [req.input] if isinstance(req.input, str) else req.input
+        result = await asyncio.get_running_loop().run_in_executor(runner.embed_executor, runner.embed, texts)
         return {
-            "content": generated,
-            "stop": True,
+            "object": "list",
             "model": str(runner.model_path.name),
-            "tokens_predicted": req.max_tokens,
-            "tokens_evaluated": len(runner.tokenizer.encode(req.prompt))
+            "data": [
+                {"object": "embedding", "index": i, "embedding": vec}
+                for i, vec in enumerate(result["embeddings"])
+            ],
+            "usage": {"prompt_tokens": result["prompt_tokens"], "total_tokens": result["prompt_tokens"]},
         }
     
+    @app.post("/completion")
+    async def completion(req: GenerateRequest, request: Request):
+        """Generate completion (llama.cpp compatible endpoint, SSE when stream=true)"""
+        runner = state.require()
+        n_predict = req.n_predict if req.n_predict is not None else req.max_tokens
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+        cancel = threading.Event()
+        
+        def on_text(text: str) -> None:
+            loop.call_soon_threadsafe(events.put_nowait, text)
+        
+        def on_done() -> None:
+            loop.call_soon_threadsafe(events.put_nowait, None)
+        
+        try:
+            job = runner.start_generation(
+                prompt=req.prompt,
+                max_tokens=n_predict,
+                temperature=req.temperature,
+                top_p=req.top_p,
+                top_k=req.top_k,
+                stop=req.stop,
+                seed=req.seed,
+                repeat_penalty=req.repeat_penalty,
+                num_ctx=req.num_ctx,
+                cancel=cancel,
+                on_text=on_text if req.stream else None,
+                on_done=on_done,
+            )
+        except RunnerBusy as e:
+            raise HTTPException(status_code=503, detail=f"Runner busy: {e}", headers={"Retry-After": "1"})
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        def error_chunk(message: str) -> Dict:
+            # Same shape llama.cpp streams when a generation fails
+            return {"error": {"code": 500, "message": message, "type": "server_error"}}
+        
+        def final_chunk() -> Dict:
+            result = runner.job_result(job)
+            return {
+                "content": "" if req.stream else result["content"],
+                "stop": True,
+                "stopped_word": result["stopped_word"],
+                "stopping_word": result["stopping_word"],
+                "model": str(runner.model_path.name),
+                "tokens_predicted": result["tokens_predicted"],
+                "tokens_evaluated": result["tokens_evaluated"],
+                "truncated": result.get("truncated", False),
+                "timings": result.get("timings", {})
+            }
+        
+        if req.stream:
+            async def sse():
+                try:
+                    while (text := await events.get()) is not None:
+                        yield f"data: {json.dumps({'content': text, 'stop': False})}\n\n"
+                    error = runner.job_result(job).get("error")
+                    chunk = error_chunk(error) if error else final_chunk()
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                finally:
+                    # Client disconnects land here and free the batch row
+                    cancel.set()
+            
+            return StreamingResponse(sse(), media_type="text/event-stream")
+        
+        async def watch_disconnect():
+            while not cancel.is_set():
+                if await request.is_disconnected():
+                    cancel.set()
+                    print("⚠️ Client disconnected, generation cancelled")
+                    return
+                await asyncio.sleep(0.25)
+        
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            while await events.get() is not None:
+                pass
+        finally:
+            cancel.set()
+            watcher.cancel()
+        error = runner.job_result(job).get("error")
+        if error:
+            raise HTTPException(status_code=500, detail=f"Generation failed: {error}")
+        return final_chunk()
+    
     return app
 
 
@@ -147,15 +240,33 @@ if __name__ == "__main__":
     parser.add_argument("--model", "-m", required=True, help="Path to model directory")
     parser.add_argument("--port", "-p", type=int, default=8080, help="Server port")
     parser.add_argument("--device", "-d", default="auto", help="Device (auto/cpu/cuda)")
+    parser.add_argument("--embed-batch-size", type=int, default=32, help="Inputs per embedding forward pass")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="Max concurrent prompts per generate() call")
+    parser.add_argument("--batch-wait-ms", type=float, default=10, help="How long a batch waits for more prompts")
+    parser.add_argument("--max-queue", type=int, default=64, help="Queued requests before answering 503")
+    parser.add_argument("--quantize", choices=QUANTIZE_MODES, default="none", help="CPU weight format: int8 (dynamic) or bf16")
     
     args = parser.parse_args()
     
-    # Create runner
-    runner = TransformersRunner(args.model, device=args.device)
+    # Load the model in the background; the server answers /health meanwhile
+    state = RunnerState(args.model)
+    threading.Thread(
+        target=state.load,
+        kwargs={
+            "model_path": args.model,
+            "device": args.device,
+            "embed_batch_size": args.embed_batch_size,
+            "max_batch_size": args.max_batch_size,
+            "batch_wait_ms": args.batch_wait_ms,
+            "max_queue": args.max_queue,
+            "quantize": args.quantize,
+        },
+        name="model-loader",
+        daemon=True,
+    ).start()
     
     # Create and run server
-    app = create_server(runner, args.port)
+    app = create_server(state, args.port)
     
     print(f"\n🚀 Starting Transformers Runner on port {args.port}")
     uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="info")
-
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bounded session store for the API gateway.
+
+Sessions live in an OrderedDict kept in last-seen order, so both TTL expiry
+and LRU eviction only ever look at the oldest entries. Entries use
+__slots__ to stay small. With a db_path, changes are flushed to SQLite in
+the background and reloaded on start.
+"""
+from __future__ import annotations
+
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class Session:
+    __slots__ = ("session_id", "created_at", "last_seen", "last_model", "slot", "runtime_pid", "history")
+
+    def __init__(self, session_id: str, created_at: float) -> None:
+        self.session_id = session_id
+        self.created_at = created_at
+        self.last_seen = created_at
+        self.last_model: Optional[str] = None
+        self.slot: Optional[int] = None
+        self.runtime_pid: Optional[int] = None
+        # Chat turns kept server-side: {"role", "content", "tokens"}
+        self.history: List[Dict] = []
+
+    def history_tokens(self) -> int:
+        return sum(m.get("tokens", 0) for m in self.history)
+
+    def to_dict(self) -> Dict:
+        d = {
+            "session_id": self.session_id,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(),
+            "last_seen_at": datetime.fromtimestamp(self.last_seen).isoformat(),
+        }
+        if self.last_model:
+            d["last_model"] = self.last_model
+        if self.slot is not None:
+            d["slot"] = self.slot
+            d["runtime_pid"] = self.runtime_pid
+        if self.history:
+            d["turns"] = len(self.history)
+            d["history_tokens"] = self.history_tokens()
+        return d
+
+
+class SessionStore:
+    def __init__(self, ttl_sec: int = 86400, max_sessions: int = 10000, db_path: Optional[Path] = None) -> None:
+        self.ttl_sec = ttl_sec
+        self.max_sessions = max_sessions
+        self.db_path = db_path
+        self._sessions: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty: set = set()
+        self._deleted: set = set()
+        self.expired = 0
+        self.evicted = 0
+        if db_path is not None:
+            self._load()
+
+    def _mark(self, session_id: str, deleted: bool) -> None:
+        """Record a change for the next flush (no-op without persistence)."""
+        if self.db_path is None:
+            return
+        if deleted:
+            self._dirty.discard(session_id)
+            self._deleted.add(session_id)
+        else:
+            self._deleted.discard(session_id)
+            self._dirty.add(session_id)
+
+    @staticmethod
+    def new_id() -> str:
+        return f"sess-{secrets.token_hex(8)}"
+
+    def _drop_oldest(self, now: float) -> None:
+        # Oldest entries are at the front; stop at the first live one
+        while self._sessions:
+            sid, s = next(iter(self._sessions.items()))
+            if now - s.last_seen >= self.ttl_sec:
+                self.expired += 1
+            elif len(self._sessions) > self.max_sessions:
+                self.evicted += 1
+            else:
+                break
+            self._sessions.popitem(last=False)
+            self._mark(sid, deleted=True)
+
+    def touch(
+        self,
+        session_id: str,
+        last_model: Optional[str] = None,
+        slot: Optional[int] = None,
+        runtime_pid: Optional[int] = None,
+    ) -> Session:
+        now = time.time()
+        with self._lock:
+            s = self._sessions.get(session_id)
+            if s is None or now - s.last_seen >= self.ttl_sec:
+                s = Session(session_id, now)
+                self._sessions[session_id] = s
+            s.last_seen = now
+            if last_model:
+                s.last_model = last_model
+            if slot is not None:
+                s.slot = slot
+                s.runtime_pid = runtime_pid
+            self._sessions.move_to_end(session_id)
+            self._mark(session_id, deleted=False)
+            self._drop_oldest(now)
+            return s
+
+    def set_history(self, session_id: str, history: List[Dict]) -> None:
+        with self._lock:
+            s = self._sessions.get(session_id)
+            if s is not None:
+                s.history = history
+                self._mark(session_id, deleted=False)
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            s = self._sessions.get(session_id)
+            if s is not None and time.time() - s.last_seen >= self.ttl_sec:
+                self._sessions.pop(session_id, None)
+                self._mark(session_id, deleted=True)
+                self.expired += 1
+                return None
+            return s
+
+    def pop(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            s = self._sessions.pop(session_id, None)
+            self._mark(session_id, deleted=True)
+            return s
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def purge_expired(self) -> None:
+        with self._lock:
+            self._drop_oldest(time.time())
+
+    def stats(self) -> Dict:
+        return {
+            "active": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "ttl_sec": self.ttl_sec,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "persisted": self.db_path is not None,
+        }
+
+    # ------------------------
+    # SQLite persistence
+    # ------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.db_path))
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                created_at REAL,
+                last_seen REAL,
+                last_model TEXT,
+                slot INTEGER,
+                runtime_pid INTEGER,
+                history TEXT
+            )
+            """
+        )
+        try:
+            conn.execute("ALTER TABLE sessions ADD COLUMN history TEXT")
+        except sqlite3.OperationalError:
+            pass  # column already present
+        return conn
+
+    def _load(self) -> None:
+        conn = self._connect()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT session_id, created_at, last_seen, last_model, slot, runtime_pid, history FROM sessions "
+            "WHERE last_seen >= ? ORDER BY last_seen DESC LIMIT ?",
+            (time.time() - self.ttl_sec, self.max_sessions),
+        )
+        rows = cur.fetchall()
+        conn.close()
+        for r in reversed(rows):
+            s = Session(r[0], r[1])
+            s.last_seen, s.last_model, s.slot, s.runtime_pid = r[2], r[3], r[4], r[5]
+            s.history = json.loads(r[6]) if r[6] else []
+            self._sessions[s.session_id] = s
+
+    def flush(self) -> None:
+        """Write changed sessions and deletions to SQLite."""
+        if self.db_path is None:
+            return
+        with self._lock:
+            rows = [
+                (s.session_id, s.created_at, s.last_seen, s.last_model, s.slot, s.runtime_pid,
+                 json.dumps(s.history, ensure_ascii=False) if s.history else None)
+                for s in (self._sessions.get(sid) for sid in self._dirty) if s is not None
+            ]
+            deleted = [(sid,) for sid in self._deleted]
+            self._dirty.clear()
+            self._deleted.clear()
+        if not rows and not deleted:
+            return
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.executemany("DELETE FROM sessions WHERE session_id=?", deleted)
+            conn.execute("DELETE FROM sessions WHERE last_seen < ?", (time.time() - self.ttl_sec,))
+        conn.close()
+
+    def start_maintenance(self, interval_sec: int = 10) -> None:
+        """Expire idle sessions and flush to SQLite on a daemon thread."""
+        def _loop() -> None:
+            while True:
+                time.sleep(interval_sec)
+                try:
+                    self.purge_expired()
+                    self.flush()
+                except Exception:
+                    pass
+
+        threading.Thread(target=_loop, daemon=True).start()
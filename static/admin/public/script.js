@@ -78,4 +78,60 @@ function clearTestResults() {
             <p>Test results will appear here</p>
         </div>
     `;
-}
\ No newline at end of file
+}
+// Gateway monitoring (request rollups from /monitoring/timeseries)
+const MONITORING_BASE_URL = location.protocol.startsWith('http') ? '' : 'http://localhost:8155';
+
+async function fetchMonitoring(endpoint, params = {}) {
+    const query = new URLSearchParams(
+        Object.entries(params).filter(([, v]) => v !== undefined && v !== null)
+    ).toString();
+    const response = await fetch(`${MONITORING_BASE_URL}${endpoint}${query ? '?' + query : ''}`);
+    if (!response.ok) throw new Error(`${endpoint}: HTTP ${response.status}`);
+    return await response.json();
+}
+
+// Rollups for the last `seconds` (route/model narrow it to one series)
+function fetchTimeseries(seconds, params = {}) {
+    const end = Date.now() / 1000;
+    return fetchMonitoring('/monitoring/timeseries', { start: end - seconds, end, ...params });
+}
+
+function formatMs(ms) {
+    if (ms === null || ms === undefined) return '–';
+    return ms >= 1000 ? `${(ms / 1000).toFixed(2)}s` : `${Math.round(ms)}ms`;
+}
+
+function latencyClass(ms) {
+    if (ms === null || ms === undefined) return '';
+    return ms < 500 ? 'success' : ms < 2000 ? 'warning' : 'danger';
+}
+
+// Inline SVG line chart; lines = [{key, color, label}] read from each point
+function renderLineChart(container, points, lines) {
+    if (!points.length) {
+        container.innerHTML = `
+            <div class="metrics-placeholder">
+                <i class="fas fa-chart-line metrics-icon"></i>
+                <p>No requests in this range yet</p>
+            </div>
+        `;
+        return;
+    }
+    const width = 600, height = 160;
+    const max = Math.max(1, ...points.flatMap(p => lines.map(l => p[l.key] || 0)));
+    const t0 = points[0].ts, span = Math.max(1, points[points.length - 1].ts - t0);
+    const x = p => points.length === 1 ? width / 2 : ((p.ts - t0) / span) * width;
+    const y = v => height - ((v || 0) / max) * height;
+    const polylines = lines.map(l => `
+        <polyline style="fill: none; stroke: ${l.color}; stroke-width: 2;" vector-effect="non-scaling-stroke"
+            points="${points.map(p => `${x(p).toFixed(1)},${y(p[l.key]).toFixed(1)}`).join(' ')}" />
+    `).join('');
+    const legend = lines.map(l => `<span style="color: ${l.color}; margin-right: 12px;">● ${l.label}</span>`).join('');
+    container.innerHTML = `
+        <svg viewBox="0 0 ${width} ${height}" preserveAspectRatio="none" style="width: 100%; height: calc(100% - 24px);">
+            ${polylines}
+        </svg>
+        <div style="font-size: 12px; color: var(--text-secondary);">${legend} max ${Math.round(max)}</div>
+    `;
+}
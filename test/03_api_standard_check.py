@@ -12,11 +12,11 @@ def main():
     except Exception as e:
         out["checks"]["tags_error"] = str(e); out["ok"] = False
 
-    # generate should be 200 when runtime is ready, else 409; both acceptable forms
+    # generate auto-loads the model: 200 when ready, 503 if still loading
     try:
-        r = requests.post(f"{BASE}/api/generate", json={"model":"tinyllama","prompt":"ping"}, timeout=10)
+        r = requests.post(f"{BASE}/api/generate", json={"model":"tinyllama","prompt":"ping"}, timeout=180)
         out["checks"]["generate_code"] = r.status_code
-        if r.status_code not in (200, 409):
+        if r.status_code not in (200, 503):
             out["ok"] = False
     except Exception as e:
         out["checks"]["generate_error"] = str(e); out["ok"] = False
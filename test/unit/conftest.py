@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""Unit tests run without a server: put the repo root and scripts/ on sys.path."""
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+for path in (ROOT, ROOT / "scripts"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from transformers_engine import BatchScheduler, GenerationJob, RunnerBusy  # noqa: E402
+
+
+class StubRunner:
+    """Stands in for TransformersRunner: records batches instead of generating."""
+
+    def __init__(self, gate: threading.Event = None, fail: bool = False):
+        self.batches = []
+        self.gate = gate
+        self.fail = fail
+        self.started = threading.Event()
+
+    def _generate_batch(self, jobs):
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.batches.append(list(jobs))
+        if self.fail:
+            raise RuntimeError("boom")
+        for job in jobs:
+            job.generated = 1
+            job.result = {"content": "x", "tokens_predicted": 1}
+
+
+def _job(temperature=0.0, seed=None, cancel=None):
+    return GenerationJob([1, 2, 3], 4, temperature, 0.95, None, None, [], seed, cancel)
+
+
+def _wait(jobs):
+    for job in jobs:
+        assert job.done.wait(5)
+
+
+def test_jobs_arriving_together_share_a_batch():
+    runner = StubRunner()
+    sched = BatchScheduler(runner, max_batch_size=8, batch_wait_ms=50)
+    jobs = [_job() for _ in range(3)]
+    with sched.cond:  # the worker cannot take a batch until all are queued
+        for job in jobs:
+            sched.submit(job)
+    _wait(jobs)
+    assert [len(b) for b in runner.batches] == [3]
+    assert all(job.result["content"] == "x" for job in jobs)
+    assert sched.stats()["tokens_generated"] == 3
+
+
+def test_batches_split_by_sampling_settings_and_size():
+    runner = StubRunner()
+    sched = BatchScheduler(runner, max_batch_size=2, batch_wait_ms=50)
+    greedy = [_job() for _ in range(3)]
+    sampled = _job(temperature=0.7)
+    with sched.cond:
+        for job in greedy + [sampled]:
+            sched.submit(job)
+    _wait(greedy + [sampled])
+    assert sorted(len(b) for b in runner.batches) == [1, 1, 2]
+    for batch in runner.batches:
+        assert len({job.batch_key for job in batch}) == 1
+
+
+def test_seeded_jobs_run_alone():
+    runner = StubRunner()
+    sched = BatchScheduler(runner, max_batch_size=8, batch_wait_ms=50)
+    jobs = [_job(seed=7), _job(seed=7)]
+    with sched.cond:
+        for job in jobs:
+            sched.submit(job)
+    _wait(jobs)
+    assert [len(b) for b in runner.batches] == [1, 1]
+
+
+def test_full_queue_raises_runner_busy():
+    gate = threading.Event()
+    runner = StubRunner(gate=gate)
+    sched = BatchScheduler(runner, max_batch_size=1, batch_wait_ms=0, max_queue=2)
+    first = _job()
+    sched.submit(first)
+    assert runner.started.wait(5)  # worker is now busy with the first job
+    queued = [_job(), _job()]
+    for job in queued:
+        sched.submit(job)
+    with pytest.raises(RunnerBusy):
+        sched.submit(_job())
+    gate.set()
+    _wait([first] + queued)
+
+
+def test_cancelled_job_is_finished_without_running():
+    runner = StubRunner()
+    sched = BatchScheduler(runner, batch_wait_ms=0)
+    cancel = threading.Event()
+    cancel.set()
+    job = _job(cancel=cancel)
+    sched.submit(job)
+    _wait([job])
+    assert runner.batches == [] and job.result is None
+
+
+def test_generation_error_is_set_on_every_job():
+    runner = StubRunner(fail=True)
+    sched = BatchScheduler(runner, batch_wait_ms=50)
+    jobs = [_job(), _job()]
+    with sched.cond:
+        for job in jobs:
+            sched.submit(job)
+    _wait(jobs)
+    assert all(isinstance(job.error, RuntimeError) for job in jobs)
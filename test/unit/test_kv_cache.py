@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from pathlib import Path
+
+from kv_cache import SessionKVCache, _safe_name
+
+
+def test_slot_file_names_are_distinct_and_safe():
+    names = {_safe_name(sid) for sid in ("a/b", "a_b", "a\\b", "a b")}
+    assert len(names) == 4
+    for name in names:
+        assert Path(name).name == name and name.endswith(".bin")
+
+
+def test_long_ids_stay_bounded(tmp_path):
+    cache = SessionKVCache(tmp_path, max_bytes=1 << 20)
+    path = cache.path_for("m", "x" * 500)
+    assert len(path.name) < 130
+    assert cache.path_for("m", "x" * 500) == path
+    assert cache.path_for("m", "x" * 501) != path
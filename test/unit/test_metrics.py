@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from metrics import MetricsRegistry
+
+
+def test_finished_threads_fold_into_the_base_shard():
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "Requests", ("route",))
+    histogram = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1))
+
+    def work():
+        for _ in range(10):
+            counter.inc("/x")
+            histogram.observe("/x", value=0.5)
+
+    for _ in range(5):
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert counter.values() == {("/x",): 400.0}
+    assert len(counter._shards) == 0 and len(histogram._shards) == 0
+    text = registry.render()
+    assert 'latency_seconds_bucket{route="/x",le="1"} 400' in text
+    assert 'latency_seconds_count{route="/x"} 400' in text
+
+
+def test_labels_must_match():
+    counter = MetricsRegistry().counter("c", "C", ("a", "b"))
+    with pytest.raises(ValueError):
+        counter.inc("only-one")
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from response_cache import ResponseCache, is_complete, is_deterministic
+
+PAYLOAD = {"prompt": "hi", "temperature": 0, "n_predict": 16}
+DONE = {"content": "hello", "stop": True, "tokens_predicted": 2}
+
+
+def test_key_ignores_transport_fields_and_order():
+    key = ResponseCache.make_key("sha256:a", PAYLOAD)
+    noisy = {"stream": True, "cache_prompt": True, "id_slot": 3, **dict(reversed(list(PAYLOAD.items())))}
+    assert ResponseCache.make_key("sha256:a", noisy) == key
+
+
+def test_key_depends_on_model_and_options():
+    key = ResponseCache.make_key("sha256:a", PAYLOAD)
+    assert ResponseCache.make_key("sha256:b", PAYLOAD) != key
+    assert ResponseCache.make_key("sha256:a", {**PAYLOAD, "n_predict": 17}) != key
+
+
+def test_lru_eviction():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})
+    assert cache.get("a") == {"v": 1}  # a is now most recent
+    cache.put("c", {"v": 3})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1} and cache.get("c") == {"v": 3}
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1
+    assert stats["hits"] == 3 and stats["misses"] == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    ResponseCache(max_entries=1, disk_dir=tmp_path).put("k" * 64, DONE)
+    cache = ResponseCache(max_entries=1, disk_dir=tmp_path)
+    assert cache.get("k" * 64) == DONE
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_disk_tier_is_pruned(tmp_path):
+    cache = ResponseCache(max_entries=1, disk_dir=tmp_path, max_disk_entries=10)
+    for i in range(25):
+        cache.put(f"{i:064x}", {"v": i})
+    assert len(list(tmp_path.glob("*/*.json"))) <= 10
+
+
+def test_is_deterministic():
+    assert is_deterministic({"temperature": 0})
+    assert is_deterministic({"temperature": 0.7, "seed": 42})
+    assert not is_deterministic({"temperature": 0.7})
+    assert not is_deterministic({"temperature": 0.7, "seed": -1})
+
+
+def test_non_numeric_options_are_not_cacheable():
+    assert not is_deterministic({"temperature": "abc"})
+    assert not is_deterministic({"temperature": 0.7, "seed": [1]})
+
+
+def test_is_complete_rejects_failed_and_partial_results():
+    assert is_complete(DONE)
+    assert not is_complete({**DONE, "error": "boom"})
+    assert not is_complete({**DONE, "stop": False})  # stream cut off or cancelled
+    assert not is_complete({**DONE, "truncated": True})
+    assert not is_complete({**DONE, "tokens_predicted": 0})
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import sys
+
+from router import DEFAULT_LLAMA_CPP_FLAGS, build_runtime_command
+
+VALUES = {"model_path": "models/m/m.gguf", "port": 8081, "threads": 4}
+GGUF_RULE = {
+    "command": "bin/server",
+    "args": ["--model", "{model_path}", "--port", "{port}", "--threads", "{threads}", "--ctx-size", "2048"],
+    "option_flags": DEFAULT_LLAMA_CPP_FLAGS,
+}
+
+
+def _gguf(tmp_path, options=None):
+    (tmp_path / "bin").mkdir(exist_ok=True)
+    (tmp_path / "bin" / "server").touch()
+    return build_runtime_command(tmp_path, "gguf", GGUF_RULE, VALUES, options)
+
+
+def test_renders_placeholders_and_configured_command(tmp_path):
+    cmd = _gguf(tmp_path)
+    assert cmd[0] == str(tmp_path / "bin" / "server")
+    assert cmd[1:] == ["--model", "models/m/m.gguf", "--port", "8081", "--threads", "4", "--ctx-size", "2048"]
+
+
+def test_value_option_replaces_template_flag(tmp_path):
+    cmd = _gguf(tmp_path, {"ctx_size": 8192, "parallel": 4})
+    assert cmd.count("--ctx-size") == 1
+    assert cmd[cmd.index("--ctx-size") + 1] == "8192"
+    assert cmd[cmd.index("--parallel") + 1] == "4"
+
+
+def test_boolean_options(tmp_path):
+    cmd = _gguf(tmp_path, {"mlock": True, "mmap": False, "cont_batching": False})
+    assert "--mlock" in cmd
+    assert "--no-mmap" in cmd
+    assert "--no-cont-batching" in cmd and "--cont-batching" not in cmd
+    cmd = _gguf(tmp_path, {"mlock": False, "mmap": True, "cont_batching": True})
+    assert "--mlock" not in cmd and "--no-mmap" not in cmd
+    assert "--cont-batching" in cmd
+
+
+def test_flash_attn_takes_a_value(tmp_path):
+    on = _gguf(tmp_path, {"flash_attn": True})
+    off = _gguf(tmp_path, {"flash_attn": False})
+    assert on[on.index("--flash-attn") + 1] == "on"
+    assert off[off.index("--flash-attn") + 1] == "off"
+    assert off.count("--flash-attn") == 1
+
+
+def test_unknown_and_none_options_are_skipped(tmp_path):
+    assert _gguf(tmp_path, {"no_such_option": 1, "batch_size": None}) == _gguf(tmp_path)
+
+
+def test_safetensors_uses_current_python(tmp_path):
+    rule = {
+        "command": "python",
+        "args": ["scripts/transformers_runner.py", "--model", "{model_path}", "--port", "{port}"],
+        "option_flags": {"parallel": "--max-batch-size", "batch_wait_ms": "--batch-wait-ms"},
+    }
+    cmd = build_runtime_command(tmp_path, "safetensors", rule, VALUES, {"parallel": 8, "batch_wait_ms": 5})
+    assert cmd[0] == sys.executable
+    assert cmd[-4:] == ["--max-batch-size", "8", "--batch-wait-ms", "5"]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import time
+import types
+
+import pytest
+
+import session_store
+from session_store import SessionStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = {"t": 1_000_000.0}
+    monkeypatch.setattr(session_store, "time", types.SimpleNamespace(time=lambda: now["t"], sleep=time.sleep))
+    return now
+
+
+def test_ttl_expiry(clock):
+    store = SessionStore(ttl_sec=60)
+    store.touch("s1", last_model="m")
+    clock["t"] += 59
+    assert store.get("s1").last_model == "m"
+    clock["t"] += 60
+    assert store.get("s1") is None
+    assert "s1" not in store
+    assert store.stats()["expired"] == 1
+
+
+def test_touch_after_expiry_starts_a_fresh_session(clock):
+    store = SessionStore(ttl_sec=60)
+    store.touch("s1")
+    store.set_history("s1", [{"role": "user", "content": "hi", "tokens": 1}])
+    clock["t"] += 120
+    s = store.touch("s1")
+    assert s.history == [] and s.created_at == clock["t"]
+
+
+def test_purge_expired_drops_idle_sessions(clock):
+    store = SessionStore(ttl_sec=60)
+    store.touch("old")
+    clock["t"] += 30
+    store.touch("new")
+    clock["t"] += 45
+    store.purge_expired()
+    assert len(store) == 1 and "new" in store
+
+
+def test_lru_eviction_keeps_recently_used(clock):
+    store = SessionStore(ttl_sec=3600, max_sessions=2)
+    store.touch("a")
+    clock["t"] += 1
+    store.touch("b")
+    clock["t"] += 1
+    store.touch("a")
+    clock["t"] += 1
+    store.touch("c")
+    assert "b" not in store
+    assert "a" in store and "c" in store
+    assert store.stats()["evicted"] == 1
+
+
+def test_sessions_persist_to_sqlite(tmp_path):
+    db = tmp_path / "sessions.db"
+    store = SessionStore(ttl_sec=3600, db_path=db)
+    store.touch("s1", last_model="m", slot=2, runtime_pid=99)
+    store.set_history("s1", [{"role": "user", "content": "hi", "tokens": 1}])
+    store.touch("gone")
+    store.pop("gone")
+    store.flush()
+    reloaded = SessionStore(ttl_sec=3600, db_path=db)
+    s = reloaded.get("s1")
+    assert (s.last_model, s.slot, s.runtime_pid) == ("m", 2, 99)
+    assert s.history_tokens() == 1
+    assert "gone" not in reloaded
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from timeseries import LatencyTimeSeries
+
+
+def _minute_ago(minutes: int) -> float:
+    return (int(time.time()) // 60 - minutes) * 60.0
+
+
+def test_minute_rollup_counts_and_latency():
+    ts = LatencyTimeSeries()
+    t = _minute_ago(5)
+    for latency, status in ((10, 200), (30, 200), (50, 500), (70, 404)):
+        ts.record("/api/generate", "m", latency, status, ts=t + 1)
+    ts.record("/api/generate", "m", 100, 200, ts=t + 61)
+    out = ts.query(start=t, end=t + 119, resolution="minute")
+    assert out["step_sec"] == 60
+    first, second = out["points"]
+    assert first["ts"] == t and second["ts"] == t + 60
+    assert (first["requests"], first["errors"], first["client_errors"]) == (4, 1, 1)
+    assert first["avg_ms"] == 40.0 and first["max_ms"] == 70.0
+    assert out["summary"]["requests"] == 5
+
+
+def test_hour_rollup_merges_minutes():
+    ts = LatencyTimeSeries()
+    hour = (int(time.time()) // 3600 - 1) * 3600.0
+    for minute in range(3):
+        ts.record("/api/chat", "m", 20, 200, ts=hour + minute * 60)
+    out = ts.query(start=hour, end=hour + 3599, resolution="hour")
+    assert [p["requests"] for p in out["points"]] == [3]
+    assert out["points"][0]["ts"] == hour
+
+
+def test_percentiles_are_ordered_and_bounded():
+    ts = LatencyTimeSeries()
+    t = _minute_ago(2)
+    for latency in range(1, 101):
+        ts.record("/v1/completions", "m", latency, 200, ts=t)
+    p = ts.query(start=t, end=t + 59, resolution="minute")["summary"]
+    assert p["p50_ms"] <= p["p95_ms"] <= p["p99_ms"] <= p["max_ms"] == 100.0
+    assert 20 <= p["p50_ms"] <= 100
+
+
+def test_filters_by_route_and_model():
+    ts = LatencyTimeSeries()
+    t = _minute_ago(1)
+    ts.record("/api/chat", "a", 10, 200, ts=t)
+    ts.record("/api/chat", "b", 10, 200, ts=t)
+    ts.record("/health", "", 1, 200, ts=t)
+    assert ts.query(route="/api/chat", start=t, end=t + 59)["summary"]["requests"] == 2
+    assert ts.query(route="/api/chat", model="b", start=t, end=t + 59)["summary"]["requests"] == 1
+
+
+def test_old_samples_never_overwrite_a_newer_slot():
+    ts = LatencyTimeSeries(minute_slots=5)
+    now = _minute_ago(0)
+    ts.record("/x", "", 10, 200, ts=now)
+    ts.record("/x", "", 10, 200, ts=now - 5 * 60)  # same ring slot, older period
+    out = ts.query(start=now - 600, end=now + 59, resolution="minute")
+    assert [(p["ts"], p["requests"]) for p in out["points"]] == [(now, 1)]
+
+
+def test_series_cap_counts_dropped():
+    ts = LatencyTimeSeries(max_series=2)
+    for route in ("/a", "/b", "/c"):
+        ts.record(route, "", 1, 200)
+    assert ts.stats()["series"] == 2 and ts.stats()["dropped"] == 1
+
+
+def test_unknown_resolution_is_rejected():
+    with pytest.raises(ValueError):
+        LatencyTimeSeries().query(resolution="day")
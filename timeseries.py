@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fixed-size latency/throughput rollups for the admin dashboards.
+
+Each (route, model) series keeps two ring buffers, per-minute and per-hour,
+backed by array.array. A slot holds request and error counts, the latency
+sum and max, and a log-spaced latency histogram (for percentiles). A slot
+is reused once its period falls out of the window, so memory is fixed per
+series no matter how many requests arrive.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+# Upper bounds (ms) of the latency histogram bins; the last bin is open-ended
+LATENCY_BOUNDS_MS = (
+    1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 30000, 60000, 120000, 300000,
+)
+_BINS = len(LATENCY_BOUNDS_MS) + 1
+
+RESOLUTIONS = {"minute": 60, "hour": 3600}
+
+
+class _Ring:
+    """One resolution of one series: `slots` periods of `step` seconds."""
+
+    def __init__(self, step: int, slots: int) -> None:
+        self.step = step
+        self.slots = slots
+        self.period = array("q", [-1]) * slots  # which period a slot currently holds
+        self.requests = array("I", [0]) * slots
+        self.errors = array("I", [0]) * slots  # 5xx
+        self.client_errors = array("I", [0]) * slots  # 4xx
+        self.sum_ms = array("d", [0.0]) * slots
+        self.max_ms = array("d", [0.0]) * slots
+        self.hist = array("I", [0]) * (slots * _BINS)
+
+    def _slot(self, period: int) -> Optional[int]:
+        i = period % self.slots
+        if self.period[i] > period:
+            return None  # older than the window; would wipe a newer period
+        if self.period[i] != period:
+            self.period[i] = period
+            self.requests[i] = self.errors[i] = self.client_errors[i] = 0
+            self.sum_ms[i] = self.max_ms[i] = 0.0
+            base = i * _BINS
+            self.hist[base:base + _BINS] = array("I", [0]) * _BINS
+        return i
+
+    def record(self, ts: float, latency_ms: float, status: int) -> None:
+        i = self._slot(int(ts // self.step))
+        if i is None:
+            return
+        self.requests[i] += 1
+        if status >= 500:
+            self.errors[i] += 1
+        elif status >= 400:
+            self.client_errors[i] += 1
+        self.sum_ms[i] += latency_ms
+        if latency_ms > self.max_ms[i]:
+            self.max_ms[i] = latency_ms
+        self.hist[i * _BINS + bisect_left(LATENCY_BOUNDS_MS, latency_ms)] += 1
+
+    def rows(self, first: int, last: int) -> Dict[int, Tuple]:
+        """period -> (requests, errors, client_errors, sum_ms, max_ms, hist) for live periods in range."""
+        out = {}
+        for period in range(max(first, last - self.slots + 1), last + 1):
+            i = period % self.slots
+            if self.period[i] != period or not self.requests[i]:
+                continue
+            base = i * _BINS
+            out[period] = (
+                self.requests[i], self.errors[i], self.client_errors[i],
+                self.sum_ms[i], self.max_ms[i], self.hist[base:base + _BINS],
+            )
+        return out
+
+
+def _percentile(hist, total: int, q: float, max_ms: float) -> Optional[float]:
+    """Latency at quantile q, interpolated inside the histogram bin (capped at the max seen)."""
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for b, count in enumerate(hist):
+        if count and seen + count >= rank:
+            lo = LATENCY_BOUNDS_MS[b - 1] if b > 0 else 0
+            hi = LATENCY_BOUNDS_MS[b] if b < len(LATENCY_BOUNDS_MS) else lo * 2
+            return round(min(lo + (hi - lo) * (rank - seen) / count, max_ms), 1)
+        seen += count
+    return round(max_ms, 1)
+
+
+def _summarize(ts: Optional[int], step: int, requests: int, errors: int, client_errors: int,
+               sum_ms: float, max_ms: float, hist) -> Dict:
+    point = {} if ts is None else {"ts": ts}
+    point.update({
+        "requests": requests,
+        "errors": errors,
+        "client_errors": client_errors,
+        "error_rate": round(errors / requests, 4) if requests else 0.0,
+        "rps": round(requests / step, 4),
+        "avg_ms": round(sum_ms / requests, 1) if requests else None,
+        "p50_ms": _percentile(hist, requests, 0.50, max_ms),
+        "p95_ms": _percentile(hist, requests, 0.95, max_ms),
+        "p99_ms": _percentile(hist, requests, 0.99, max_ms),
+        "max_ms": round(max_ms, 1) if requests else None,
+    })
+    return point
+
+
+class LatencyTimeSeries:
+    def __init__(self, minute_slots: int = 1440, hour_slots: int = 720, max_series: int = 200) -> None:
+        self.slots = {"minute": minute_slots, "hour": hour_slots}
+        self.max_series = max_series
+        self._series: Dict[Tuple[str, str], Dict[str, _Ring]] = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def record(self, route: str, model: str, latency_ms: float, status: int, ts: Optional[float] = None) -> None:
+        ts = time.time() if ts is None else ts
+        key = (route, model or "")
+        with self._lock:
+            rings = self._series.get(key)
+            if rings is None:
+                if len(self._series) >= self.max_series:
+                    # Fixed memory: beyond the cap new series are counted, not stored
+                    self.dropped += 1
+                    return
+                rings = self._series[key] = {
+                    name: _Ring(step, self.slots[name]) for name, step in RESOLUTIONS.items()
+                }
+            for ring in rings.values():
+                ring.record(ts, latency_ms, status)
+
+    def query(
+        self,
+        route: Optional[str] = None,
+        model: Optional[str] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        resolution: str = "auto",
+    ) -> Dict:
+        """Merge matching series into one point per period between start and end.
+
+        route/model of None match every series. "auto" picks minutes while
+        the range fits in the minute window (and is at most 6 hours), else hours.
+        """
+        now = time.time()
+        end = now if end is None else end
+        start = end - 3600 if start is None else start
+        if resolution == "auto":
+            minute_oldest = (int(now // 60) - self.slots["minute"] + 1) * 60
+            resolution = "minute" if end - start <= 6 * 3600 and start >= minute_oldest else "hour"
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution must be one of {sorted(RESOLUTIONS)} or 'auto'")
+        step = RESOLUTIONS[resolution]
+        last = int(end // step)
+        # Nothing older than the window survives; clamping keeps rps honest
+        first = max(int(start // step), int(now // step) - self.slots[resolution] + 1)
+
+        merged: Dict[int, List] = {}
+        matched = []
+        with self._lock:
+            for (r, m), rings in self._series.items():
+                if (route is not None and r != route) or (model is not None and m != model):
+                    continue
+                matched.append({"route": r, "model": m})
+                for period, (req, err, cerr, sum_ms, max_ms, hist) in rings[resolution].rows(first, last).items():
+                    acc = merged.get(period)
+                    if acc is None:
+                        merged[period] = [req, err, cerr, sum_ms, max_ms, list(hist)]
+                        continue
+                    acc[0] += req
+                    acc[1] += err
+                    acc[2] += cerr
+                    acc[3] += sum_ms
+                    acc[4] = max(acc[4], max_ms)
+                    acc[5] = [a + b for a, b in zip(acc[5], hist)]
+
+        total = [0, 0, 0, 0.0, 0.0, [0] * _BINS]
+        points = []
+        for period in sorted(merged):
+            req, err, cerr, sum_ms, max_ms, hist = merged[period]
+            points.append(_summarize(period * step, step, req, err, cerr, sum_ms, max_ms, hist))
+            total = [total[0] + req, total[1] + err, total[2] + cerr, total[3] + sum_ms,
+                     max(total[4], max_ms), [a + b for a, b in zip(total[5], hist)]]
+        span_sec = max(step, (last - first + 1) * step)
+        return {
+            "resolution": resolution,
+            "step_sec": step,
+            "start": first * step,
+            "end": (last + 1) * step,
+            "series": sorted(matched, key=lambda s: (s["route"], s["model"])),
+            "summary": _summarize(None, span_sec, *total),
+            "points": points,
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "series": len(self._series),
+                "max_series": self.max_series,
+                "minute_slots": self.slots["minute"],
+                "hour_slots": self.slots["hour"],
+                "dropped": self.dropped,
+            }
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lightweight per-request tracing.
+
+A Trace is opened for each HTTP request and made current through a
+ContextVar, so span() calls anywhere below the endpoint (including
+asyncio.to_thread workers, which copy the context) attach to it. Stages
+that happen inside a runtime are added afterwards from its reported
+timings with Trace.add_span(). Finished traces are handed to a
+TraceExporter, which writes them on its own thread as JSONL lines or OTLP/HTTP
+JSON so exporting never blocks a request.
+"""
+from __future__ import annotations
+
+import json
+import os
+import queue
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+TRACE_HEADER = "X-Trace-Id"
+
+_TRACE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+_CURRENT_TRACE: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_CURRENT_SPAN: ContextVar[Optional[str]] = ContextVar("current_span", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+def valid_trace_id(value: Optional[str]) -> Optional[str]:
+    """A caller-supplied trace id if it is 32 lowercase-able hex chars (W3C/OTLP size)."""
+    value = (value or "").strip().lower()
+    if _TRACE_ID_RE.match(value) and value != "0" * 32:
+        return value
+    return None
+
+
+class Trace:
+    """Spans of one request; timestamps are perf_counter_ns, mapped to wall time on export."""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None) -> None:
+        self.trace_id = trace_id or _new_id(16)
+        self.root_id = _new_id(8)
+        self.name = name
+        self.attributes: Dict = {}
+        self.spans: List[Dict] = []
+        self._wall0 = time.time_ns()
+        self._perf0 = time.perf_counter_ns()
+        self._end: Optional[int] = None
+
+    def add_span(
+        self,
+        name: str,
+        start_ns: int,
+        end_ns: int,
+        parent_id: Optional[str] = None,
+        span_id: Optional[str] = None,
+        **attributes,
+    ) -> Dict:
+        """Record a finished span (perf_counter_ns bounds) and return it."""
+        span = {
+            "span_id": span_id or _new_id(8),
+            "parent_id": parent_id or self.root_id,
+            "name": name,
+            "start_ns": start_ns,
+            "end_ns": max(start_ns, end_ns),
+            "attributes": attributes,
+        }
+        # list.append is atomic, so worker threads can add spans too
+        self.spans.append(span)
+        return span
+
+    def finish(self, **attributes) -> None:
+        self.attributes.update(attributes)
+        self._end = time.perf_counter_ns()
+
+    def _wall(self, perf_ns: int) -> int:
+        return self._wall0 + (perf_ns - self._perf0)
+
+    @property
+    def duration_ms(self) -> float:
+        end = self._end or time.perf_counter_ns()
+        return (end - self._perf0) / 1e6
+
+    def to_dict(self) -> Dict:
+        """One JSONL record: the root span followed by its descendants."""
+        end = self._end or time.perf_counter_ns()
+        spans = [{
+            "span_id": self.root_id,
+            "parent_id": None,
+            "name": self.name,
+            "start_unix_nano": self._wall0,
+            "duration_ms": round((end - self._perf0) / 1e6, 3),
+            "attributes": self.attributes,
+        }]
+        for s in sorted(self.spans, key=lambda s: s["start_ns"]):
+            spans.append({
+                "span_id": s["span_id"],
+                "parent_id": s["parent_id"],
+                "name": s["name"],
+                "start_unix_nano": self._wall(s["start_ns"]),
+                "duration_ms": round((s["end_ns"] - s["start_ns"]) / 1e6, 3),
+                "attributes": s["attributes"],
+            })
+        return {"trace_id": self.trace_id, "name": self.name, "duration_ms": spans[0]["duration_ms"], "spans": spans}
+
+    def to_otlp_spans(self) -> List[Dict]:
+        end = self._end or time.perf_counter_ns()
+        rows = [(self.root_id, None, self.name, self._perf0, end, self.attributes)]
+        rows += [(s["span_id"], s["parent_id"], s["name"], s["start_ns"], s["end_ns"], s["attributes"]) for s in self.spans]
+        out = []
+        for span_id, parent_id, name, start, stop, attributes in rows:
+            span = {
+                "traceId": self.trace_id,
+                "spanId": span_id,
+                "name": name,
+                "kind": 2 if parent_id is None else 1,  # SERVER for the request, INTERNAL below
+                "startTimeUnixNano": str(self._wall(start)),
+                "endTimeUnixNano": str(self._wall(stop)),
+                "attributes": [_otlp_attribute(k, v) for k, v in attributes.items() if v is not None],
+            }
+            if parent_id:
+                span["parentSpanId"] = parent_id
+            out.append(span)
+        return out
+
+
+def _otlp_attribute(key: str, value) -> Dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def current_trace() -> Optional[Trace]:
+    return _CURRENT_TRACE.get()
+
+
+def current_span_id() -> Optional[str]:
+    return _CURRENT_SPAN.get()
+
+
+def activate(trace: Trace):
+    """Make trace current; returns the token for deactivate()."""
+    return _CURRENT_TRACE.set(trace)
+
+
+def deactivate(token) -> None:
+    _CURRENT_TRACE.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Dict]:
+    """Time the enclosed block as a child of the current span.
+
+    Yields the attribute dict so the block can add results to it. Without a
+    current trace this is a no-op.
+    """
+    trace = _CURRENT_TRACE.get()
+    if trace is None:
+        yield attributes
+        return
+    parent = _CURRENT_SPAN.get()
+    span_id = _new_id(8)
+    token = _CURRENT_SPAN.set(span_id)
+    start = time.perf_counter_ns()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        trace.add_span(name, start, time.perf_counter_ns(), parent, span_id, **attributes)
+
+
+class TraceExporter:
+    """Writes finished traces on a background thread; drops them if it falls behind."""
+
+    def __init__(
+        self,
+        exporter: str = "jsonl",
+        path: Optional[Path] = None,
+        otlp_endpoint: Optional[str] = None,
+        service_name: str = "zombiecoder-gateway",
+        min_duration_ms: float = 0,
+        max_queue: int = 1000,
+    ) -> None:
+        if exporter not in ("jsonl", "otlp"):
+            raise ValueError(f"unknown trace exporter '{exporter}'")
+        self.exporter = exporter
+        self.path = path
+        self.otlp_endpoint = otlp_endpoint
+        self.service_name = service_name
+        self.min_duration_ms = min_duration_ms
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._loop, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, trace: Trace) -> None:
+        if trace.duration_ms < self.min_duration_ms:
+            return
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            # Drain whatever else is waiting so a burst is one write / one POST
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if self.exporter == "jsonl":
+                    self._write_jsonl(batch)
+                else:
+                    self._post_otlp(batch)
+                self.exported += len(batch)
+            except Exception:
+                self.failed += len(batch)
+
+    def _write_jsonl(self, traces: List[Trace]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(t.to_dict(), ensure_ascii=False) + "\n" for t in traces)
+
+    def _post_otlp(self, traces: List[Trace]) -> None:
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": "zombiecoder.tracing"},
+                    "spans": [s for t in traces for s in t.to_otlp_spans()],
+                }],
+            }]
+        }
+        req = urllib.request.Request(
+            self.otlp_endpoint,
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            resp.read()
+
+    def stats(self) -> Dict:
+        return {
+            "exporter": self.exporter,
+            "path": str(self.path) if self.path else None,
+            "otlp_endpoint": self.otlp_endpoint if self.exporter == "otlp" else None,
+            "queued": self._queue.qsize(),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }